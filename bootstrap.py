@@ -5,16 +5,22 @@ import sublime_plugin
 import os
 import sys
 import time
+import hashlib
+import queue
 import threading
 
-from package_control.package_installer import PackageInstallerThread
 from package_control.thread_progress import ThreadProgress
 from package_control.package_manager import PackageManager
 from package_control.package_disabler import PackageDisabler
 
 from .lib import install_font
+from .lib.settings_transaction import SettingsTransaction
+from .lib.patch_registry import PatchRegistry
 from .lib.fix_markdown_editing_enter_glitch import fix_markdown_editing_enter_glitch
 
+# every hack on third-party packages, applied again when the package is updated
+patch_registry = PatchRegistry()
+
 class MakeOneLineCodeCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         code = self.view.substr(self.view.sel()[0])
@@ -22,12 +28,27 @@ class MakeOneLineCodeCommand(sublime_plugin.TextCommand):
         sublime.set_clipboard('; '.join(lines))
 
 
+def markdown_editing_package_path():
+    return os.path.join(sublime.installed_packages_path(), 'MarkdownEditing.sublime-package')
+
+
+def patch_markdown_editing(pkg_file):
+    fix_markdown_editing_enter_glitch(os.path.dirname(pkg_file), sublime.cache_path())
+
+
+patch_registry.register('MarkdownEditing', markdown_editing_package_path, patch_markdown_editing)
+
+
 class FixMarkdwonEditingEnterGlitchCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        fix_markdown_editing_enter_glitch(sublime.installed_packages_path(), sublime.cache_path())
+        patch_registry.apply('MarkdownEditing')
 
 
-def fix_convert_to_utf8_prompt():
+def convert_to_utf8_path():
+    return os.path.join(sublime.packages_path(), 'ConvertToUTF8', 'ConvertToUTF8.py')
+
+
+def patch_convert_to_utf8(target_py_path):
     # hack ConvertToUTF8: consider ASCII as UTF8
     origine_code = '''\
         if not_detected:
@@ -52,11 +73,19 @@ def fix_convert_to_utf8_prompt():
             ])
 '''
 
-    target_py_path = os.path.join(sublime.packages_path(), 'ConvertToUTF8', 'ConvertToUTF8.py')
     with open(target_py_path, 'r') as f:
-        newcode = f.read().replace(origine_code.replace('    ', '\t'), hack_code.replace('    ', '\t'))
-    with open(target_py_path, 'w') as f:
-        f.write(newcode)
+        code = f.read()
+    newcode = code.replace(origine_code.replace('    ', '\t'), hack_code.replace('    ', '\t'))
+    if newcode != code:
+        with open(target_py_path, 'w') as f:
+            f.write(newcode)
+
+
+patch_registry.register('ConvertToUTF8', convert_to_utf8_path, patch_convert_to_utf8)
+
+
+def fix_convert_to_utf8_prompt():
+    patch_registry.apply('ConvertToUTF8')
 
 
 class FixConvertToUtfPrompt(sublime_plugin.TextCommand):
@@ -72,68 +101,66 @@ def string_ver(ver_tuple):
     return '.'.join(str(v) for v in ver_tuple)
 
 
-class RemovePackageThread(threading.Thread, PackageDisabler):
+def reenable_packages(disabler, packages, operation):
+    if not packages:
+        return
+    if hasattr(disabler, 'reenable_packages'):
+        # Package Control 4 re-enables a whole batch with one settings write
+        disabler.reenable_packages(packages, operation)
+    else:
+        for package in packages:
+            disabler.reenable_package(package, operation)
+
+
+class PackageBatchThread(threading.Thread):
 
     """
-    A thread to run the remove package operation in so that the Sublime Text
-    UI does not become frozen
+    A thread to run the remove or install operation of a batch of packages,
+    several packages at a time, so that the Sublime Text UI does not become
+    frozen
     """
 
-    def __init__(self, manager, package, on_complete=None):
-        self.manager = manager
-        self.package = package
+    def __init__(self, operation, packages, workers=1, delay=0, on_complete=None):
+        self.operation = operation
+        self.packages = packages
+        self.workers = max(1, min(workers, len(packages)))
+        self.delay = delay
         self.on_complete = on_complete
+        self.results = {}
         threading.Thread.__init__(self)
 
+    def work(self, pending):
+        # every worker has its own manager, they are not shared across threads
+        manager = PackageManager()
+        while True:
+            try:
+                package = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if self.operation == 'remove':
+                    result = manager.remove_package(package)
+                else:
+                    result = manager.install_package(package)
+            except Exception as e:
+                print('RanTool {} {} failed: {}'.format(self.operation, package, e))
+                result = False
+            self.results[package] = result
+
     def run(self):
         # Let the package disabling take place
-        time.sleep(0.7)
-        self.result = self.manager.remove_package(self.package)
-
-        # Do not reenable if removing deferred until next restart
-        if self.result is not None:
-            def unignore_package():
-                self.reenable_package(self.package, 'remove')
-                if self.on_complete:
-                    sublime.set_timeout(self.on_complete, 10)
-            sublime.set_timeout(unignore_package, 200)
-        else:
-            if self.on_complete:
-                sublime.set_timeout(self.on_complete, 10)
-
-
-def install(manager, package, on_complete):
-    disabler = PackageDisabler()
-
-    if package in disabler.disable_packages(package, 'install'):
-        def inner_on_complete():
-            disabler.reenable_package(package, 'install')
-            on_complete()
-    else:
-        inner_on_complete = on_complete
-
-    thread = PackageInstallerThread(manager, package, inner_on_complete)
-    thread.start()
-    ThreadProgress(
-        thread,
-        'Installing package %s' % package,
-        'Package %s successfully installed' % package
-    )
-
-
-def remove(manager, package, on_complete):
-    disabler = PackageDisabler()
-
-    if package in disabler.disable_packages(package, 'remove'):
-        thread = RemovePackageThread(manager, package, on_complete)
-        thread.start()
-        ThreadProgress(
-            thread,
-            'Removing package %s' % package,
-            'Package %s successfully removed' % package
-        )
-    else:
-        on_complete()
+        time.sleep(self.delay)
+        pending = queue.Queue()
+        for package in self.packages:
+            pending.put(package)
+        workers = [threading.Thread(target=self.work, args=(pending,))
+                   for _ in range(self.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self.on_complete:
+            sublime.set_timeout(self.on_complete, 10)
 
 
 class UpdateProcess:
@@ -143,35 +170,94 @@ class UpdateProcess:
         self.since = since
         self.fn = fn
 
-    def update(self, on_complete=None):
+    def update(self, transaction, on_complete=None):
         # if previous_version < self.since <= current_version:
-        self.fn()
+        self.fn(transaction)
         if on_complete:
             sublime.set_timeout(on_complete, 100)
 
 
-def chain_update(remove_packages, install_packages, processes, on_complete=None):
-    manager = PackageManager()
-    remove_queue = remove_packages[:]
-    install_queue = install_packages[:]
-    processes_queue = processes[:]
-
-    def launch_next():
-        if remove_queue:
-            package = remove_queue.pop(0)
-            time.sleep(0.2)
-            remove(manager, package, on_complete=launch_next)
-        elif install_queue:
-            package = install_queue.pop(0)
-            time.sleep(0.2)
-            install(manager, package, on_complete=launch_next)
-        elif processes_queue:
-            process = processes_queue.pop(0)
-            time.sleep(0.2)
-            process.update(on_complete=launch_next)
-        elif on_complete:
-            sublime.set_timeout(on_complete, 1000)
-    launch_next()
+class ChainScheduler:
+
+    """
+    Run the remove, install and update steps of an upgrade, one after the other.
+
+    Every remove runs first, in one batch (a removed package may conflict
+    with its replacement), then every install in one batch, then the update
+    processes one by one in version order. A batch disables and re-enables
+    its packages together and runs `workers` downloads at once.
+    """
+
+    def __init__(self, remove_packages, install_packages, processes,
+                 workers=1, on_complete=None):
+        self.steps = ([('remove', package) for package in remove_packages]
+                      + [('install', package) for package in install_packages]
+                      + [('process', process) for process in sorted(processes, key=lambda process: process.since)])
+        self.done = set()
+        self.workers = workers
+        self.on_complete = on_complete
+        self.disabler = PackageDisabler()
+        # every update process writes into it, it is saved when all of them are done
+        self.transaction = SettingsTransaction()
+
+    def launch_next(self):
+        pending = [i for i in range(len(self.steps)) if i not in self.done]
+        for operation in ('remove', 'install'):
+            batch = [i for i in pending if self.steps[i][0] == operation]
+            if batch:
+                self.launch_batch(operation, batch)
+                return
+
+        if pending:
+            index = pending[0]
+            self.steps[index][1].update(self.transaction, on_complete=lambda: self.complete([index]))
+        else:
+            self.transaction.flush()
+            if self.on_complete:
+                sublime.set_timeout(self.on_complete, 1000)
+
+    def complete(self, indexes):
+        self.done.update(indexes)
+        self.launch_next()
+
+    def launch_batch(self, operation, batch):
+        packages = [self.steps[i][1] for i in batch]
+        disabled = self.disabler.disable_packages(packages, operation) or []
+        if operation == 'remove':
+            # only remove the packages that could be disabled
+            packages = [package for package in packages if package in disabled]
+            if not packages:
+                self.complete(batch)
+                return
+
+        def on_batch_complete():
+            if operation == 'remove':
+                # Do not reenable if removing deferred until next restart
+                reenable = [package for package in disabled
+                            if thread.results.get(package) is not None]
+            else:
+                reenable = disabled
+            reenable_packages(self.disabler, reenable, operation)
+            self.complete(batch)
+
+        thread = PackageBatchThread(operation, packages, self.workers,
+                                    delay=0.7 if operation == 'remove' else 0,
+                                    on_complete=on_batch_complete)
+        thread.start()
+        verb = 'Removing' if operation == 'remove' else 'Installing'
+        ThreadProgress(
+            thread,
+            '{} package {}'.format(verb, ', '.join(packages)),
+            'Package {} successfully {}'.format(', '.join(packages),
+                                                'removed' if operation == 'remove' else 'installed')
+        )
+
+
+def chain_update(remove_packages, install_packages, processes,
+                 on_complete=None, workers=1):
+    scheduler = ChainScheduler(remove_packages, install_packages, processes,
+                               workers=workers, on_complete=on_complete)
+    scheduler.launch_next()
 
 
 def since(since_version):
@@ -249,7 +335,7 @@ pakages_since = [
 ]
 
 @since("1.0.0")
-def setting100():
+def setting100(transaction):
     defaults = {
         "color_scheme": "Packages/Ancient (ranlempow)/Ancient.tmTheme",
         "fold_buttons": False,
@@ -269,15 +355,11 @@ def setting100():
         "theme_tab_font_sm": True,
         "theme_tab_size_md": True
     }
-
-    base_settings = sublime.load_settings('Preferences.sublime-settings')
-    for key, value in defaults.items():
-        base_settings.set(key, value)
-    sublime.save_settings('Preferences.sublime-settings')
+    transaction.update('Preferences.sublime-settings', defaults)
 
 
 @since("1.3.0")
-def setting130():
+def setting130(transaction):
     # Add to Markdown.sublime-settings
     # this is a hack to solve MarkdownEditing config problem
 
@@ -289,13 +371,10 @@ def setting130():
         "line_numbers": True,
         "margin": 32
     }
-    markdown_settings = sublime.load_settings('Markdown.sublime-settings')
-    for key, value in md_defaults.items():
-        markdown_settings.set(key, value)
-    sublime.save_settings('Markdown.sublime-settings')
+    transaction.update('Markdown.sublime-settings', md_defaults)
 
 @since("1.4.0")
-def setting140():
+def setting140(transaction):
     # change some defualt setting
     defaults = {
         "fold_buttons": False,
@@ -306,14 +385,11 @@ def setting140():
         "theme_sidebar_folder_atomized": True,
         "theme_sidebar_folder_mono": True,
     }
-    base_settings = sublime.load_settings('Preferences.sublime-settings')
-    for key, value in defaults.items():
-        base_settings.set(key, value)
-    sublime.save_settings('Preferences.sublime-settings')
+    transaction.update('Preferences.sublime-settings', defaults)
 
 
 @since("1.4.1")
-def setting141():
+def setting141(transaction):
     # change some defualt setting
 
     if not install_font.has_font('Hack Regular Nerd Font Complete.ttf'):
@@ -325,15 +401,12 @@ def setting141():
         "theme": "Monokai Pro.sublime-theme",
 
     }
-    base_settings = sublime.load_settings('Preferences.sublime-settings')
-    for key, value in defaults.items():
-        base_settings.set(key, value)
-    base_settings.erase('theme_sidebar_font_lg')
-    base_settings.erase('theme_tab_font_sm')
-    base_settings.erase('theme_tab_size_md')
-    base_settings.erase('theme_sidebar_folder_atomized')
-    base_settings.erase('theme_sidebar_folder_mono')
-    sublime.save_settings('Preferences.sublime-settings')
+    transaction.update('Preferences.sublime-settings', defaults)
+    transaction.erase('Preferences.sublime-settings', 'theme_sidebar_font_lg')
+    transaction.erase('Preferences.sublime-settings', 'theme_tab_font_sm')
+    transaction.erase('Preferences.sublime-settings', 'theme_tab_size_md')
+    transaction.erase('Preferences.sublime-settings', 'theme_sidebar_folder_atomized')
+    transaction.erase('Preferences.sublime-settings', 'theme_sidebar_folder_mono')
 
     sublimelinter_defaults = {
         "gutter_theme": "Packages/Theme - Monokai Pro/Monokai Pro.gutter-theme",
@@ -360,15 +433,12 @@ def setting141():
         "lint_mode": "save",
         "show_panel_on_save": "view",
     }
-    sb_settings = sublime.load_settings('SublimeLinter.sublime-settings')
-    for key, value in sublimelinter_defaults.items():
-        sb_settings.set(key, value)
-    sublime.save_settings('SublimeLinter.sublime-settings')
+    transaction.update('SublimeLinter.sublime-settings', sublimelinter_defaults)
 
 @since("1.5.0")
-def setting150():
+def setting150(transaction):
     if sys.platform == 'darwin':
-        fix_markdown_editing_enter_glitch(sublime.installed_packages_path(), sublime.cache_path())
+        patch_registry.apply('MarkdownEditing')
 
     defaults = {
         "preview_on_right_click": False,
@@ -376,21 +446,17 @@ def setting150():
         "theme_sidebar_folder_atomized": True,
         "theme_sidebar_folder_mono": True,
     }
-    base_settings = sublime.load_settings('Preferences.sublime-settings')
-    for key, value in defaults.items():
-        base_settings.set(key, value)
+    transaction.update('Preferences.sublime-settings', defaults)
 
     # hack ConvertToUTF8: consider ASCII as UTF8
     fix_convert_to_utf8_prompt()
 
 @since("1.5.2")
-def setting150():
+def setting152(transaction):
     defaults = {
         "theme": "Monokai Pro (Filter Spectrum).sublime-theme",
     }
-    base_settings = sublime.load_settings('Preferences.sublime-settings')
-    for key, value in defaults.items():
-        base_settings.set(key, value)
+    transaction.update('Preferences.sublime-settings', defaults)
 
 
 class ToolProgressMemory:
@@ -404,50 +470,85 @@ class ToolProgressMemory:
         current_version = tuple_ver(self.tool_settings.get("current_version"))
         return previous_version, current_version
 
-    def save_progress_version(self, new_version):
+    def load_parallel_installs(self):
+        return self.tool_settings.get('parallel_installs', 4)
+
+    def load_plan_fingerprint(self):
+        return self.tool_settings.get('plan_fingerprint')
+
+    def save_progress_version(self, new_version, fingerprint=None):
         self.tool_settings.set('previous_version', string_ver(new_version))
+        if fingerprint is not None:
+            self.tool_settings.set('plan_fingerprint', fingerprint)
         sublime.save_settings('RansTool.sublime-settings')
 
 
-def plugin_loaded():
-    # tool_settings = sublime.load_settings('RansTool.sublime-settings')
-    # previous_version = tuple_ver(tool_settings.get("previous_version", "0.0.0"))
-    # if tool_settings.get('bootstrapped') is True and previous_version == (0, 0, 0):
-    #     previous_version = (0, 0, 1)
-    # current_version = tuple_ver(tool_settings.get("current_version"))
-    progress_memory = ToolProgressMemory()
-    previous_version, current_version = progress_memory.load_progress_version()
-
+def extra_packages_path():
+    confighome = os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
+    configpath = os.environ.get('ST_LIFE_USERCONFIG_PATH', os.path.join(confighome, 'sublime-life'))
+    return os.path.join(configpath, 'extra-packages.ini')
+
+
+def plan_fingerprint(current_version, extra_packages_file):
+    # everything the update plan is computed from, the installed packages are
+    # the names in the packages folders, so a package removed by hand is installed again
+    digest = hashlib.sha1()
+    digest.update(string_ver(current_version).encode('utf-8'))
+    digest.update(repr(pakages_since).encode('utf-8'))
+    digest.update(repr([p.since for p in UpdateProcess.update_processes]).encode('utf-8'))
+    try:
+        stat = os.stat(extra_packages_file)
+        digest.update('{} {}'.format(stat.st_mtime, stat.st_size).encode('utf-8'))
+    except OSError:
+        digest.update(b'no extra packages')
+    for folder in (sublime.installed_packages_path(), sublime.packages_path()):
+        try:
+            digest.update(repr(sorted(os.listdir(folder))).encode('utf-8'))
+        except OSError:
+            digest.update(b'no folder')
+    return digest.hexdigest()
+
+
+def read_extra_packages(extra_packages_file):
+    if not os.path.exists(extra_packages_file):
+        return []
+    with open(extra_packages_file) as f:
+        return [pkg.strip() for pkg in f.readlines() if pkg.strip() ]
+
+
+def compute_plan(previous_version, current_version, installed_packages, extra_packages=()):
+    """
+    Compute what an update from `previous_version` to `current_version` does.
+    Return the packages to remove, the packages to install, the update
+    processes to run, and the version which asked for each package.
+    """
     candidate_remove = []
     candidate_install = []
+    # the version which asked for each package, used to order the chain update
+    candidate_since = {}
     for since, removes, installs in pakages_since:
         since = tuple_ver(since)
         if previous_version < since <= current_version:
             for rm in removes:
+                candidate_since[rm] = since
                 if rm in candidate_install:
                     candidate_install.remove(rm)
                 elif rm not in candidate_remove:
                     candidate_remove.append(rm)
             for ins in installs:
+                candidate_since[ins] = since
                 if ins in candidate_remove:
                     candidate_remove.remove(ins)
                 elif ins not in candidate_install:
                     candidate_install.append(ins)
 
-    confighome = os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
-    configpath = os.environ.get('ST_LIFE_USERCONFIG_PATH', os.path.join(confighome, 'sublime-life'))
-
-    extra_packages_file = os.path.join(configpath, 'extra-packages.ini')
-    if os.path.exists(extra_packages_file):
-        with open(extra_packages_file) as f:
-            extra_packages = [pkg.strip() for pkg in f.readlines() if pkg.strip() ]
-        for expkg in extra_packages:
-            if expkg in candidate_remove:
-                candidate_remove.remove(expkg)
-            elif expkg not in candidate_install:
-                candidate_install.append(expkg)
+    for expkg in extra_packages:
+        candidate_since[expkg] = current_version
+        if expkg in candidate_remove:
+            candidate_remove.remove(expkg)
+        elif expkg not in candidate_install:
+            candidate_install.append(expkg)
 
-    installed_packages = PackageManager().list_packages()
     remove_packages = []
     install_packages = []
     for inspkg in candidate_install:
@@ -464,14 +565,41 @@ def plugin_loaded():
             print('RanTool remove {}'.format(rmpkg))
             remove_packages.append(rmpkg)
 
-
     processes = []
     for p in UpdateProcess.update_processes:
         if previous_version < p.since <= current_version:
             processes.append(p)
+    return remove_packages, install_packages, processes, candidate_since
+
+
+def plugin_loaded():
+    # tool_settings = sublime.load_settings('RansTool.sublime-settings')
+    # previous_version = tuple_ver(tool_settings.get("previous_version", "0.0.0"))
+    # if tool_settings.get('bootstrapped') is True and previous_version == (0, 0, 0):
+    #     previous_version = (0, 0, 1)
+    # current_version = tuple_ver(tool_settings.get("current_version"))
+    patch_registry.load(os.path.join(sublime.cache_path(), 'RansTool', 'patches.json'))
+    # patch again the packages updated since, costs one stat per patched file
+    patch_registry.refresh()
+
+    progress_memory = ToolProgressMemory()
+    previous_version, current_version = progress_memory.load_progress_version()
+
+    extra_packages_file = extra_packages_path()
+    fingerprint = plan_fingerprint(current_version, extra_packages_file)
+    if previous_version == current_version and progress_memory.load_plan_fingerprint() == fingerprint:
+        # nothing changed since the last update, do not even ask PackageManager
+        return
+
+    extra_packages = read_extra_packages(extra_packages_file)
+    installed_packages = PackageManager().list_packages()
+    remove_packages, install_packages, processes, _ = compute_plan(
+        previous_version, current_version, installed_packages, extra_packages)
 
     def on_complete():
-        progress_memory.save_progress_version(current_version)
+        # the update installed and removed packages, the next start compares with the folders now
+        updated_fingerprint = plan_fingerprint(current_version, extra_packages_file)
+        progress_memory.save_progress_version(current_version, updated_fingerprint)
         # tool_settings.set('previous_version', string_ver(current_version))
         # sublime.save_settings('RansTool.sublime-settings')
         if remove_packages or install_packages or processes:
@@ -482,7 +610,8 @@ def plugin_loaded():
         else:
             sublime.active_window().status_message("Sublime Life is nothing to update")
 
-    chain_update(remove_packages, install_packages, processes, on_complete=on_complete)
+    chain_update(remove_packages, install_packages, processes, on_complete=on_complete,
+                 workers=progress_memory.load_parallel_installs())
     # if remove_packages or install_packages or processes:
     #     chain_update(remove_packages, install_packages, processes, on_complete=on_complete)
     # else:
@@ -50,9 +50,55 @@ class ChooseFontCommand(sublime_plugin.WindowCommand):
         ('Meiryo UI', '15', 'CJK'),
     ]
     targets = ['All File', 'Text File', 'Program Language File']
+    def preview_suite(self, index):
+        # only the active view changes, nothing is written to disk until confirmed
+        fontface, fontsize, *_ = self.suites[index]
+        if self.preview_view is not None:
+            settings = self.preview_view.settings()
+            settings.set('font_face', fontface)
+            settings.set('font_size', int(fontsize))
+
+        for neighbor in (index, index - 1, index + 1):
+            if 0 <= neighbor < len(self.suites):
+                self.prefetch_font(self.suites[neighbor][0])
+
+    def prefetch_font(self, fontface):
+        # download missing fonts into the download cache while the user is browsing
+        if fontface in self.prefetched:
+            return
+        self.prefetched.add(fontface)
+        if not install_font.has_font(self.fonts[fontface][0]):
+            install_font.download_font(self.fonts[fontface][2].format(baseurl=self.baseurl))
+
+    def begin_preview(self, view):
+        # remember the fonts the view sets itself, the preview must not lose them
+        self.preview_view = view
+        self.preview_saved = {}
+        if view is None:
+            return
+        settings = view.settings()
+        for key in ('font_face', 'font_size'):
+            value = settings.get(key)
+            settings.erase(key)
+            # only a value of the view itself hides the inherited one
+            if settings.get(key) != value:
+                settings.set(key, value)
+                self.preview_saved[key] = value
+
+    def end_preview(self):
+        if self.preview_view is not None:
+            settings = self.preview_view.settings()
+            for key in ('font_face', 'font_size'):
+                if key in self.preview_saved:
+                    settings.set(key, self.preview_saved[key])
+                else:
+                    settings.erase(key)
+            self.preview_view = None
+
     def choose_suite(self, index):
         if index == -1:
             self.chosen = [None, None]
+            self.end_preview()
             return
         self.chosen[0] = index
 
@@ -63,6 +109,7 @@ class ChooseFontCommand(sublime_plugin.WindowCommand):
     def choose_target(self, index):
         if index == -1:
             self.chosen = [None, None]
+            self.end_preview()
             return
         self.chosen[1] = index
 
@@ -75,40 +122,57 @@ class ChooseFontCommand(sublime_plugin.WindowCommand):
             # need install font from internet
             url = self.fonts[fontface][2].format(baseurl=self.baseurl)
             self.window.status_message('downloading font from: ' + url)
-            def download_font():
-                self.download_font(url, target, fontface, fontsize)
-            sublime.set_timeout(download_font, 200)
+            self.download_font(url, target, fontface, fontsize)
         else:
             self.setfont(target, fontface, fontsize)
 
     def download_font(self, url, target, fontface, fontsize):
-        install_font.install_font(url)
-        def setfont():
-            self.setfont(target, fontface, fontsize)
-        sublime.set_timeout(setfont, 1500)
+        # download and install in background, the font is set when it is ready
+        def on_progress(done, total):
+            if total:
+                message = 'downloading font {}: {:.0%} of {:.1f} MB'.format(fontface, done / total, total / 2 ** 20)
+            else:
+                message = 'downloading font {}: {:.1f} MB'.format(fontface, done / 2 ** 20)
+            sublime.set_timeout(lambda: self.window.status_message(message), 0)
+
+        def on_complete(path):
+            install_font.install_font_file(path)
+            sublime.set_timeout(lambda: self.setfont(target, fontface, fontsize), 0)
+
+        def on_error(error):
+            message = 'unable to download font {}: {}'.format(fontface, error)
+            sublime.set_timeout(lambda: (self.end_preview(), self.window.status_message(message)), 0)
+
+        install_font.download_font(url, on_progress=on_progress, on_complete=on_complete, on_error=on_error)
 
 
     def setfont(self, target, fontface, fontsize):
+        self.end_preview()
         text_settings = sublime.load_settings('Markdown.sublime-settings')
         if target == 'All File':
             syntax_settings = sublime.load_settings('Preferences.sublime-settings')
             text_settings.erase('font_face')
             text_settings.erase('font_size')
+            changed = ['Preferences.sublime-settings', 'Markdown.sublime-settings']
         elif target == 'Program Language File':
             syntax_settings = sublime.load_settings('Preferences.sublime-settings')
+            changed = ['Preferences.sublime-settings']
         elif target == 'Text File':
             syntax_settings = text_settings
+            changed = ['Markdown.sublime-settings']
 
         syntax_settings.set('font_face', fontface)
         syntax_settings.set('font_size', fontsize)
 
-        sublime.save_settings('Preferences.sublime-settings')
-        sublime.save_settings('Markdown.sublime-settings')
+        for filename in changed:
+            sublime.save_settings(filename)
 
 
     def run(self):
 
         self.chosen = [None, None]
+        self.begin_preview(self.window.active_view())
+        self.prefetched = set()
         fontmenu = ['{1}px {0}: {2} {3}'.format(*(suite + (self.fonts[suite[0]][1],)))
                     for suite in self.suites]
-        self.window.show_quick_panel(fontmenu, self.choose_suite)
+        self.window.show_quick_panel(fontmenu, self.choose_suite, 0, 0, self.preview_suite)
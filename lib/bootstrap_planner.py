@@ -0,0 +1,251 @@
+'''
+Show and time what bootstrap.plugin_loaded does, without Sublime Text.
+
+`sublime` and `package_control` are replaced by in-memory stubs, the plan is
+computed by the same `bootstrap.compute_plan` used on startup, and the chain
+update runs against a fake package manager that sleeps instead of downloading.
+
+usage:
+    python3 lib/bootstrap_planner.py plan --previous 0.0.0 --current 1.5.2
+    python3 lib/bootstrap_planner.py plan --previous 1.4.0 --installed "GitGutter,INI"
+    python3 lib/bootstrap_planner.py bench --previous 0.0.0 --latency 0.2 --workers 4
+'''
+
+import os
+import sys
+import time
+import heapq
+import types
+import argparse
+import importlib
+import itertools
+import threading
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubSettings(dict):
+    def set(self, key, value):
+        self[key] = value
+
+    def erase(self, key):
+        self.pop(key, None)
+
+    def has(self, key):
+        return key in self
+
+    def add_on_change(self, key, on_change):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class StubSublime(types.ModuleType):
+
+    """
+    The part of the `sublime` module used by bootstrap, with set_timeout
+    callbacks run by `run_until` on the calling thread
+    """
+
+    def __init__(self):
+        super().__init__('sublime')
+        self.settings = {}
+        self.saved = []
+        self.statuses = []
+        self.timeouts = []
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+    def load_settings(self, filename):
+        return self.settings.setdefault(filename, StubSettings())
+
+    def save_settings(self, filename):
+        self.saved.append(filename)
+
+    def set_timeout(self, callback, delay=0):
+        with self.lock:
+            heapq.heappush(self.timeouts, (time.time() + delay / 1000, next(self.counter), callback))
+
+    set_timeout_async = set_timeout
+
+    def active_window(self):
+        return types.SimpleNamespace(status_message=self.statuses.append)
+
+    def packages_path(self):
+        return os.path.join(package_root, 'Packages')
+
+    def installed_packages_path(self):
+        return os.path.join(package_root, 'Installed Packages')
+
+    def cache_path(self):
+        return os.path.join(package_root, 'Cache')
+
+    def run_until(self, finished, timeout=600):
+        deadline = time.time() + timeout
+        while not finished() and time.time() < deadline:
+            with self.lock:
+                due = self.timeouts and self.timeouts[0][0] <= time.time()
+                callback = heapq.heappop(self.timeouts)[2] if due else None
+            if callback is None:
+                time.sleep(0.001)
+            else:
+                callback()
+
+
+class StubPackageManager:
+    installed = []
+    latency = 0
+    calls = []
+
+    def list_packages(self):
+        return list(self.installed)
+
+    def install_package(self, package):
+        self.calls.append(('install', package))
+        time.sleep(self.latency)
+        return True
+
+    def remove_package(self, package):
+        self.calls.append(('remove', package))
+        time.sleep(self.latency)
+        return True
+
+
+class StubPackageDisabler:
+    calls = []
+
+    def disable_packages(self, packages, operation='upgrade'):
+        packages = [packages] if isinstance(packages, str) else list(packages)
+        self.calls.append(('disable', operation, packages))
+        return packages
+
+    def reenable_package(self, package, operation='upgrade'):
+        self.calls.append(('reenable', operation, [package]))
+
+
+def install_stubs():
+    stub_sublime = StubSublime()
+    sublime_plugin = types.ModuleType('sublime_plugin')
+    for name in ('TextCommand', 'WindowCommand', 'ApplicationCommand', 'EventListener'):
+        setattr(sublime_plugin, name, type(name, (), {}))
+
+    modules = {
+        'sublime': stub_sublime,
+        'sublime_plugin': sublime_plugin,
+        'package_control': types.ModuleType('package_control'),
+        'package_control.thread_progress': types.ModuleType('package_control.thread_progress'),
+        'package_control.package_manager': types.ModuleType('package_control.package_manager'),
+        'package_control.package_disabler': types.ModuleType('package_control.package_disabler'),
+    }
+    modules['package_control.thread_progress'].ThreadProgress = lambda *args: None
+    modules['package_control.package_manager'].PackageManager = StubPackageManager
+    modules['package_control.package_disabler'].PackageDisabler = StubPackageDisabler
+    sys.modules.update(modules)
+    return stub_sublime
+
+
+def load_bootstrap():
+    stub_sublime = install_stubs()
+    package = types.ModuleType('ranstool')
+    package.__path__ = [package_root]
+    sys.modules['ranstool'] = package
+    bootstrap = importlib.import_module('ranstool.bootstrap')
+
+    # the update processes must not touch the real fonts and packages
+    bootstrap.install_font = types.SimpleNamespace(has_font=lambda font_filename: True,
+                                                   install_font=lambda url: None)
+    bootstrap.fix_markdown_editing_enter_glitch = lambda *args: None
+    bootstrap.fix_convert_to_utf8_prompt = lambda: None
+    return bootstrap, stub_sublime
+
+
+def compute_plan(bootstrap, args, quiet=False):
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        return bootstrap.compute_plan(bootstrap.tuple_ver(args.previous),
+                                      bootstrap.tuple_ver(args.current),
+                                      args.installed,
+                                      bootstrap.read_extra_packages(args.extra) if args.extra else [])
+    finally:
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+
+def print_plan(bootstrap, plan):
+    remove_packages, install_packages, processes, since_of = plan
+    for package in remove_packages:
+        print('remove  {:<40} since {}'.format(package, bootstrap.string_ver(since_of[package])))
+    for package in install_packages:
+        print('install {:<40} since {}'.format(package, bootstrap.string_ver(since_of[package])))
+    for process in processes:
+        print('process {:<40} since {}'.format(process.fn.__name__, bootstrap.string_ver(process.since)))
+
+
+def command_plan(args):
+    bootstrap, _ = load_bootstrap()
+    print_plan(bootstrap, compute_plan(bootstrap, args, quiet=True))
+
+
+def command_bench(args):
+    bootstrap, stub_sublime = load_bootstrap()
+
+    start = time.time()
+    for _ in range(args.repeat):
+        plan = compute_plan(bootstrap, args, quiet=True)
+    plan_time = (time.time() - start) / args.repeat
+    remove_packages, install_packages, processes, _ = plan
+
+    StubPackageManager.latency = args.latency
+    finished = []
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        bootstrap.chain_update(remove_packages, install_packages, processes,
+                               on_complete=lambda: finished.append(time.time()),
+                               workers=args.workers)
+        stub_sublime.run_until(lambda: finished)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print('plan       {} removes, {} installs, {} processes'.format(
+        len(remove_packages), len(install_packages), len(processes)))
+    print('compute    {:.3f} ms per plan ({} runs)'.format(plan_time * 1000, args.repeat))
+    print('chain      {:.2f} s with {} workers and {:.2f} s per package'.format(
+        finished[0] - start, args.workers, args.latency))
+    print('settings   {} writes: {}'.format(len(stub_sublime.saved), ', '.join(stub_sublime.saved)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    for name, description in (('plan', 'print the computed update plan'),
+                       ('bench', 'time the plan computation and a simulated chain update')):
+        command = commands.add_parser(name, help=description)
+        command.add_argument('--previous', default='0.0.0', help='previous RansTool version')
+        command.add_argument('--current', default='1.5.2', help='current RansTool version')
+        command.add_argument('--installed', default='', type=lambda s: [p.strip() for p in s.split(',') if p.strip()],
+                             help='comma separated installed packages')
+        command.add_argument('--extra', help='path of an extra-packages.ini')
+    bench = commands.choices['bench']
+    bench.add_argument('--repeat', type=int, default=1000, help='plan computations to average')
+    bench.add_argument('--latency', type=float, default=0.1, help='seconds to install or remove a package')
+    bench.add_argument('--workers', type=int, default=4, help='parallel package operations')
+
+    args = parser.parse_args(argv)
+    if args.command == 'plan':
+        command_plan(args)
+    elif args.command == 'bench':
+        command_bench(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''
+Download a file into a local cache, in a background thread if wanted.
+
+The body is streamed to a `.part` file chunk by chunk, a partial file left
+by an interrupted download is resumed with an HTTP range request, and a
+finished file is verified and then kept in the cache, so the same url is
+never downloaded twice.
+
+usage:
+    path = Download(url).fetch()
+    Download(url, on_progress=print).start(on_complete=print, on_error=print)
+'''
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def path_lock(path):
+    with _path_locks_guard:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+def default_cache_dir():
+    return os.path.join(tempfile.gettempdir(), 'sublime-life-downloads')
+
+
+def quote_url(url):
+    return os.path.dirname(url) + '/' + urllib.parse.quote(os.path.basename(url))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Download:
+    progress_interval = 0.25
+
+    def __init__(self, url, cache_dir=None, size=None, sha256=None,
+                 on_progress=None, chunk_size=64 * 1024):
+        self.url = url
+        self.size = size
+        self.sha256 = sha256
+        self.on_progress = on_progress
+        self.chunk_size = chunk_size
+        # keep the original file name, the font installer uses it
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        self.path = os.path.join(cache_dir or default_cache_dir(), url_hash, os.path.basename(url))
+        self.part_path = self.path + '.part'
+
+    def verify(self, path, expected_size=None):
+        size = os.path.getsize(path)
+        for expected in (expected_size, self.size):
+            if expected is not None and size != expected:
+                return False
+        return self.sha256 is None or file_sha256(path) == self.sha256
+
+    def report(self, done, total, force=False):
+        now = time.time()
+        if self.on_progress and (force or now - self.reported >= self.progress_interval):
+            self.reported = now
+            self.on_progress(done, total)
+
+    def request(self, offset):
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        try:
+            return urllib.request.urlopen(urllib.request.Request(quote_url(self.url), headers=headers))
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            # the partial file is already complete
+            return None
+
+    def fetch(self):
+        """Download the url unless it is cached, return the path of the file."""
+        # a second download of the same url waits for the first one, then hits the cache
+        with path_lock(self.path):
+            return self.fetch_unlocked()
+
+    def fetch_unlocked(self):
+        if os.path.exists(self.path) and self.verify(self.path):
+            return self.path
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        print('download {} from {}'.format(os.path.basename(self.path), self.url))
+        response = self.request(offset)
+        total = None
+        if response is not None:
+            with response:
+                if offset and response.status == 206:
+                    # Content-Range: bytes <first>-<last>/<total>
+                    content_range = response.headers.get('Content-Range', '')
+                    total_size = content_range.rpartition('/')[2]
+                    total = int(total_size) if total_size.isdigit() else None
+                    mode = 'ab'
+                else:
+                    # the server ignored the range, start over
+                    length = response.headers.get('Content-Length')
+                    total = int(length) if length and length.isdigit() else None
+                    offset = 0
+                    mode = 'wb'
+
+                done = offset
+                self.reported = 0
+                with open(self.part_path, mode) as fp:
+                    for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                        fp.write(chunk)
+                        done += len(chunk)
+                        self.report(done, total)
+                self.report(done, total, force=True)
+
+        if not self.verify(self.part_path, total):
+            os.remove(self.part_path)
+            raise IOError('downloaded file {} does not match its size or hash'.format(self.url))
+        os.replace(self.part_path, self.path)
+        return self.path
+
+    def start(self, on_complete=None, on_error=None):
+        """
+        Download in a background thread, call `on_complete(path)` or
+        `on_error(exception)`, also when on_complete raises.
+        """
+        def run():
+            try:
+                path = self.fetch()
+                if on_complete:
+                    on_complete(path)
+            except Exception as e:
+                if not on_error:
+                    raise
+                on_error(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
@@ -1,53 +1,212 @@
 import os
 import sys
-import tempfile
-import urllib
+import time
+import shutil
+import threading
+import subprocess
+
+from . import download
+
+
+def download_font(url, on_progress=None, on_complete=None, on_error=None):
+    """Download the font into the download cache in background, return the thread."""
+    return download.Download(url, on_progress=on_progress).start(on_complete, on_error)
+
 
 def install_font(url):
-    file = os.path.join(tempfile.gettempdir(), os.path.basename(url))
-    with open(file, 'wb') as fp:
-        url_p = os.path.dirname(url) + '/' + urllib.parse.quote(os.path.basename(url))
-        print('download font from {}'.format(url_p))
-        body = urllib.request.urlopen(url_p).read()
-        fp.write(body)
+    install_fonts([url])
+
+
+def install_fonts(urls):
+    install_font_files([download.Download(url).fetch() for url in urls])
+
+
+def install_font_file(file):
+    install_font_files([file])
+
+
+def user_font_dir():
     if sys.platform == 'win32':
-        vbsfile = os.path.join(os.environ['TEMP'], os.path.basename(url) + '.vbs')
-        # self.window.status_message('installing font: ' + file)
-        print('installing font {}'.format(file))
-        with open(vbsfile, 'w') as fp:
-            fp.write("""
-    Set objShell = CreateObject("Shell.Application")
-    Set objFolder = objShell.Namespace(&H14&)
-    objFolder.CopyHere("{}")
-    """.format(file))
-        os.system('wscript "{}"'.format(vbsfile))
+        # per-user fonts, supported since Windows 10 1809
+        return os.path.join(os.environ['LOCALAPPDATA'], 'Microsoft', 'Windows', 'Fonts')
     elif sys.platform == 'darwin':
-        os.system('cp {} ~/Library/Fonts'.format(file))
+        return os.path.expanduser('~/Library/Fonts')
     elif sys.platform == 'linux':
-        os.system('cp {} ~/.local/share/fonts'.format(file))
+        return os.path.expanduser('~/.local/share/fonts')
     else:
-        raise ValueError('unknown system {}'.fomrat(os.platform))
+        raise ValueError('unknown system {}'.format(sys.platform))
 
-def has_font(font_filename):
+
+def copy_font(file, font_dir):
+    # copy beside the target then rename, a font is never seen half written
+    target = os.path.join(font_dir, os.path.basename(file))
+    writing = target + '.installing'
+    shutil.copyfile(file, writing)
+    os.replace(writing, target)
+    return target
+
+
+def register_windows_fonts(files):
+    import ctypes
+    import winreg
+
+    HWND_BROADCAST = 0xFFFF
+    WM_FONTCHANGE = 0x001D
+    SMTO_ABORTIFHUNG = 0x0002
+    with winreg.CreateKey(winreg.HKEY_CURRENT_USER,
+                          r'Software\Microsoft\Windows NT\CurrentVersion\Fonts') as key:
+        for file in files:
+            name = os.path.splitext(os.path.basename(file))[0] + ' (TrueType)'
+            winreg.SetValueEx(key, name, 0, winreg.REG_SZ, file)
+            ctypes.windll.gdi32.AddFontResourceW(file)
+    ctypes.windll.user32.SendMessageTimeoutW(HWND_BROADCAST, WM_FONTCHANGE, 0, 0,
+                                             SMTO_ABORTIFHUNG, 1000, None)
+
+
+def install_font_files(files):
+    """Install a batch of font files for the current user, then refresh the font caches once."""
+    font_dir = user_font_dir()
+    os.makedirs(font_dir, exist_ok=True)
+    installed = []
+    for file in files:
+        print('installing font {}'.format(file))
+        installed.append(copy_font(file, font_dir))
+
+    if sys.platform == 'win32':
+        register_windows_fonts(installed)
+    elif sys.platform == 'linux':
+        fc_cache = shutil.which('fc-cache')
+        if fc_cache:
+            subprocess.call([fc_cache, font_dir])
+
+    if _font_index is not None:
+        _font_index.refresh(force=True)
+    return installed
+
+
+def system_font_dirs():
     if sys.platform == 'win32':
-        system_font_dir = [os.path.join(os.environ['WINDIR'], 'Fonts')]
-        if isinstance(font_filename, tuple):
-            font_filename = font_filename[1]
+        return [os.path.join(os.environ['WINDIR'], 'Fonts'), user_font_dir()]
     elif sys.platform == 'darwin':
-        system_font_dir = [os.path.expanduser('~/Library/Fonts'), '/Library/Fonts']
-        if isinstance(font_filename, tuple):
-            font_filename = font_filename[0]
+        return [os.path.expanduser('~/Library/Fonts'), '/Library/Fonts']
     elif sys.platform == 'linux':
-        system_font_dir = [os.path.expanduser('~/.local/share/fonts'), '/usr/share/fonts', '/usr/local/share/fonts']
-        if isinstance(font_filename, tuple):
-            font_filename = font_filename[0]
+        return [os.path.expanduser('~/.local/share/fonts'), '/usr/share/fonts', '/usr/local/share/fonts']
     else:
-        raise ValueError('unknown system {}'.fomrat(os.platform))
-
-    font_filename = font_filename.lower().split('.')[0]
-    for font_dir in system_font_dir:
-        if os.path.exists(font_dir):
-            files = [f.lower().split('.')[0] for f in os.listdir(font_dir)]
-            if font_filename in files:
-                return True
-    return False
+        raise ValueError('unknown system {}'.format(sys.platform))
+
+
+def normalize_font_name(filename):
+    return filename.lower().split('.')[0]
+
+
+def list_dir(directory):
+    files = []
+    subdirs = []
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(directory):
+            (subdirs if entry.is_dir() else files).append(entry.name)
+    else:
+        for name in os.listdir(directory):
+            (subdirs if os.path.isdir(os.path.join(directory, name)) else files).append(name)
+    return files, subdirs
+
+
+class FontIndex:
+
+    """
+    The normalized names of all font files under some directories.
+
+    The directories are walked recursively once, afterwards `refresh` costs
+    one stat per directory and only lists again the directories whose mtime
+    changed. `refresh(force=True)` lists them all again, a font copied in the
+    same mtime tick as the last listing is found too.
+
+    The download thread refreshes it after installing a font while the UI
+    thread looks fonts up, the lock keeps one refresh at a time.
+    """
+
+    def __init__(self, roots, max_age=5):
+        self.roots = roots
+        self.max_age = max_age
+        self.refreshed = None
+        # {directory: (mtime, normalized names, subdirectories)}
+        self.dirs = {}
+        # {normalized name: number of directories having it}
+        self.names = {}
+        # held by refresh, around scan and forget
+        self.lock = threading.Lock()
+
+    def forget(self, directory):
+        mtime, names, subdirs = self.dirs.pop(directory)
+        for name in names:
+            self.names[name] -= 1
+            if not self.names[name]:
+                del self.names[name]
+        return subdirs
+
+    def forget_tree(self, directory):
+        if directory in self.dirs:
+            for subdir in self.forget(directory):
+                self.forget_tree(subdir)
+
+    def scan(self, directory, visited, force=False):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            self.forget_tree(directory)
+            return
+        # a symlink back to a parent would make the walk endless
+        real = os.path.realpath(directory)
+        if real in visited:
+            return
+        visited.add(real)
+
+        cached = self.dirs.get(directory)
+        if cached is not None and cached[0] == mtime and not force:
+            subdirs = cached[2]
+        else:
+            old_subdirs = self.forget(directory) if cached is not None else []
+            try:
+                files, subdirs = list_dir(directory)
+            except OSError:
+                files, subdirs = [], []
+            names = set(normalize_font_name(f) for f in files)
+            subdirs = [os.path.join(directory, d) for d in subdirs]
+            for subdir in set(old_subdirs) - set(subdirs):
+                self.forget_tree(subdir)
+            for name in names:
+                self.names[name] = self.names.get(name, 0) + 1
+            self.dirs[directory] = (mtime, names, subdirs)
+
+        for subdir in subdirs:
+            self.scan(subdir, visited, force)
+
+    def refresh(self, force=False):
+        with self.lock:
+            now = time.time()
+            if force or self.refreshed is None or now - self.refreshed >= self.max_age:
+                visited = set()
+                for root in self.roots:
+                    self.scan(root, visited, force)
+                self.refreshed = now
+
+    def __contains__(self, font_filename):
+        return normalize_font_name(font_filename) in self.names
+
+
+_font_index = None
+
+
+def font_index():
+    global _font_index
+    if _font_index is None:
+        _font_index = FontIndex(system_font_dirs())
+    _font_index.refresh()
+    return _font_index
+
+
+def has_font(font_filename):
+    if isinstance(font_filename, tuple):
+        # the same font has different file names, use the one of this system
+        font_filename = font_filename[1] if sys.platform == 'win32' else font_filename[0]
+    return font_filename in font_index()
@@ -0,0 +1,89 @@
+'''
+Patch some files inside a .sublime-package (a zip archive).
+
+The members which are not patched are copied as raw compressed bytes, they
+are never decompressed and compressed again. An archive whose members are
+already patched is left untouched. The new archive is written beside the
+original and renamed over it, so the package is never half written.
+
+usage:
+    patch_package(package_file, {'Default.sublime-keymap': fix_keymap}, backup_dir='/tmp')
+'''
+
+import os
+import copy
+import shutil
+import struct
+import zipfile
+
+_local_header = struct.Struct('<4s5H3L2H')
+_descriptor_signature = b'PK\x07\x08'
+
+
+def read_raw_member(zin, info):
+    """Return the local header, the compressed data and the data descriptor of a member."""
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(_local_header.size)
+    fields = _local_header.unpack(header)
+    filename_length, extra_length = fields[-2:]
+    header += zin.fp.read(filename_length + extra_length)
+    data = zin.fp.read(info.compress_size)
+    descriptor = b''
+    if info.flag_bits & 0x08:
+        # crc and sizes follow the data, optionally after a signature
+        descriptor = zin.fp.read(4)
+        descriptor += zin.fp.read(12 if descriptor == _descriptor_signature else 8)
+    return header + data + descriptor
+
+
+def copy_raw_member(zin, zout, info):
+    raw = read_raw_member(zin, info)
+    info = copy.copy(info)
+    info.header_offset = zout.fp.tell()
+    zout.fp.write(raw)
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout._didModify = True
+    if hasattr(zout, 'start_dir'):
+        zout.start_dir = zout.fp.tell()
+
+
+def patch_package(package_file, patches, backup_dir=None):
+    """
+    Apply `patches`, a {member name: function(bytes) -> bytes}, to the package.
+    Return True if the package was changed, False if it was already patched.
+    """
+    writing = package_file + '.writing'
+    try:
+        with zipfile.ZipFile(package_file, 'r') as zin:
+            patched = {}
+            for name, patch in patches.items():
+                try:
+                    original = zin.read(name)
+                except KeyError:
+                    # not in this version of the package, nothing to patch
+                    continue
+                data = patch(original)
+                if data != original:
+                    patched[name] = data
+            if not patched:
+                return False
+
+            with zipfile.ZipFile(writing, 'w') as zout:
+                for info in zin.infolist():
+                    if info.filename in patched:
+                        zout.writestr(copy.copy(info), patched[info.filename])
+                    else:
+                        copy_raw_member(zin, zout, info)
+
+        if backup_dir is not None:
+            name, ext = os.path.splitext(os.path.basename(package_file))
+            backup = os.path.join(backup_dir, '{}_backup{}'.format(name, ext))
+            print("backup '{}' to '{}'".format(package_file, backup))
+            shutil.copy2(package_file, backup)
+        os.replace(writing, package_file)
+    finally:
+        # left behind only when patching failed
+        if os.path.exists(writing):
+            os.remove(writing)
+    return True
@@ -0,0 +1,108 @@
+'''
+Remember which files of third-party packages were patched.
+
+Each patch records the hash of its target before and after patching, and
+the size and mtime of the patched file. Applying a patch again costs one
+stat when the file did not change, and one hash when only its mtime did.
+A changed hash means the package was updated, so the patch is applied again.
+
+usage:
+    registry = PatchRegistry()
+    registry.register('ConvertToUTF8', lambda: path, patch_function)
+    registry.load(record_file)
+    registry.apply('ConvertToUTF8')
+    registry.refresh()
+
+A patch which raises is reported and its record left unchanged, it is tried
+again on the next start.
+'''
+
+import os
+import json
+import hashlib
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PatchRegistry:
+    def __init__(self):
+        # {name: (function returning the target path, function(path) patching it)}
+        self.patches = {}
+        # {name: {'path', 'source_hash', 'patched_hash', 'size', 'mtime'}}
+        self.records = {}
+        self.record_file = None
+
+    def register(self, name, path, patch):
+        self.patches[name] = (path, patch)
+
+    def load(self, record_file):
+        self.record_file = record_file
+        try:
+            with open(record_file) as fp:
+                self.records = json.load(fp)
+        except (OSError, ValueError):
+            self.records = {}
+
+    def save(self):
+        if self.record_file is None:
+            return
+        os.makedirs(os.path.dirname(self.record_file), exist_ok=True)
+        with open(self.record_file, 'w') as fp:
+            json.dump(self.records, fp, indent=1, sort_keys=True)
+
+    def apply(self, name):
+        """Patch the target unless it is already patched, return True if it was changed."""
+        try:
+            return self.apply_unchecked(name)
+        except Exception as e:
+            # a locked or broken package must not break plugin_loaded, its record
+            # is left as it was so the patch is tried again on the next start
+            print('RanTool patch {} failed: {}'.format(name, e))
+            return False
+
+    def apply_unchecked(self, name):
+        get_path, patch = self.patches[name]
+        path = get_path()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        record = self.records.get(name)
+        if record is not None and record['path'] == path:
+            if (record['size'], record['mtime']) == (stat.st_size, stat.st_mtime):
+                return False
+            source_hash = file_sha1(path)
+            if source_hash == record['patched_hash']:
+                # only touched, not changed
+                record['size'], record['mtime'] = stat.st_size, stat.st_mtime
+                self.save()
+                return False
+        else:
+            source_hash = file_sha1(path)
+
+        print('RanTool patch {} ({})'.format(name, path))
+        patch(path)
+        stat = os.stat(path)
+        patched_hash = file_sha1(path)
+        self.records[name] = {
+            'path': path,
+            'source_hash': source_hash,
+            'patched_hash': patched_hash,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+        self.save()
+        return patched_hash != source_hash
+
+    def refresh(self):
+        """Apply again the patches applied before, if their target was updated since."""
+        for name in list(self.records):
+            if name in self.patches:
+                self.apply(name)
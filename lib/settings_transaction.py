@@ -0,0 +1,54 @@
+'''
+Collect changes to several .sublime-settings files and write them at once.
+
+usage:
+    transaction = SettingsTransaction()
+    transaction.update('Preferences.sublime-settings', {'font_size': 12})
+    transaction.erase('Preferences.sublime-settings', 'theme_tab_font_sm')
+    transaction.flush()
+'''
+
+import sublime
+
+from collections import OrderedDict
+
+_erased = object()
+
+
+class SettingsTransaction:
+    def __init__(self, log=print):
+        self.log = log
+        # {settings filename: {key: value or _erased}}, last write wins
+        self.changes = OrderedDict()
+
+    def set(self, filename, key, value):
+        self.changes.setdefault(filename, OrderedDict())[key] = value
+
+    def erase(self, filename, key):
+        self.changes.setdefault(filename, OrderedDict())[key] = _erased
+
+    def update(self, filename, values):
+        for key, value in values.items():
+            self.set(filename, key, value)
+
+    def flush(self):
+        # load, change and save every settings file exactly once
+        for filename, changes in self.changes.items():
+            settings = sublime.load_settings(filename)
+            diff = []
+            for key, value in changes.items():
+                if value is _erased:
+                    if settings.has(key):
+                        settings.erase(key)
+                        diff.append('- {}'.format(key))
+                elif not settings.has(key):
+                    settings.set(key, value)
+                    diff.append('+ {} = {!r}'.format(key, value))
+                elif settings.get(key) != value:
+                    old_value = settings.get(key)
+                    settings.set(key, value)
+                    diff.append('~ {} = {!r} (was {!r})'.format(key, value, old_value))
+            if diff:
+                sublime.save_settings(filename)
+                self.log('RanTool settings {}:\n    {}'.format(filename, '\n    '.join(diff)))
+        self.changes.clear()
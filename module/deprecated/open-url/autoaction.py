@@ -0,0 +1,91 @@
+# noqa: D, V
+# Resolve which autoaction applies to a path, see open_url.sublime-settings.
+#
+# The autoactions are compiled once: rules for other operating systems are
+# dropped, patterns are translated to regexes and scored, and each pattern is
+# put in a bucket by its type and, for patterns like '*.ext', its extension.
+# Matching a path only tests the buckets of its type and extension, best first.
+
+import os
+import re
+import heapq
+import fnmatch
+import platform
+
+from domain import has_known_tld
+
+_system = platform.system()
+_os_systems = {
+    'win': ('Windows',),
+    'linux': ('Linux',),
+    'mac': ('Darwin',),
+    'posix': ('Darwin', 'Linux'),
+}
+
+
+def os_applies(auto):
+    return 'os' not in auto or _system in _os_systems.get(auto['os'], ())
+
+
+def pattern_extension(pattern):
+    # '*.exe' -> '.exe', None if the pattern is not only an extension
+    rest = pattern[1:]
+    if not pattern.startswith('*.') or '.' in rest[1:] or any(c in rest for c in '*?[/\\'):
+        return None
+    return os.path.normcase(rest)
+
+
+def path_extension(path):
+    head, dot, ext = path.rpartition('.')
+    if not dot or '/' in ext or '\\' in ext:
+        return None
+    return '.' + ext
+
+
+def score(auto, pattern):
+    # lower is better: exact os first, then the most specific pattern, then typed rules
+    return (-({'any': 0, 'posix': 1}).get(auto.get('os', 'any'), 2),
+            -(sum(2 if c == '*' else 1 for c in pattern) - int('regex' in auto or 'domain' in auto) * 10),
+            -int('type' in auto))
+
+
+class AutoactionMatcher:
+    def __init__(self, autoactions):
+        # {(type, extension): [(score, order, auto, compiled patterns, pattern index, tests)]}
+        self.buckets = {}
+        order = 0
+        for auto in autoactions:
+            if not os_applies(auto):
+                continue
+            # extra tests on the path beside the patterns
+            tests = []
+            if auto.get('regex'):
+                tests.append(re.compile(auto['regex'], re.I).search)
+            if auto.get('domain'):
+                # a host name under a known top level domain, see domain.py
+                tests.append(has_known_tld)
+            patterns = auto.get('pattern', ['*'])
+            compiled = [re.compile(fnmatch.translate(os.path.normcase(p))) for p in patterns]
+            for index, pattern in enumerate(patterns):
+                key = (auto.get('type') or None, pattern_extension(pattern))
+                entry = (score(auto, pattern), order, auto, compiled, index, tests)
+                self.buckets.setdefault(key, []).append(entry)
+                order += 1
+        for entries in self.buckets.values():
+            entries.sort(key=lambda entry: entry[:2])
+
+    def match(self, path_type, path):
+        name = os.path.normcase(path)
+        extension = path_extension(name)
+        keys = set((t, e) for t in (path_type or None, None) for e in (extension, None))
+        candidates = [self.buckets[key] for key in keys if key in self.buckets]
+        for _, _, auto, compiled, index, tests in heapq.merge(*candidates):
+            if not compiled[index].match(name):
+                continue
+            if not all(test(path) for test in tests):
+                continue
+            # a rule is scored by the first of its patterns which matches
+            if any(pattern.match(name) for pattern in compiled[:index]):
+                continue
+            return auto
+        return None
@@ -0,0 +1,257 @@
+# noqa: D, V
+# Micro benchmarks of open_url, run outside Sublime Text:
+#     python3 benchmark.py [domain] [extract] [registry] [spec]
+
+import os
+import re
+import sys
+import time
+import random
+import string
+import shutil
+import tempfile
+import threading
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def timeit(fn, items, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def long_lines(count=200, seed=1):
+    # minified-code-like lines, with and without spaces, some ending with a domain
+    rnd = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + '._-/:=;(){}'
+    endings = ['', 'google.com', 'http://example.org/a?b=c', 'foo.bar', 'x.community', 'a.b.c.d.e.f']
+    lines = []
+    for i in range(count):
+        length = rnd.choice([80, 1000, 10000])
+        line = ''.join(rnd.choice(alphabet) for _ in range(length))
+        if i % 2:
+            line = line.replace(';', ' ')
+        lines.append(line + rnd.choice(endings))
+    return lines
+
+
+def bench_domain():
+    from domain import domains, has_known_tld
+    domain_regex = r"\w[^\s]*\.(?:%s)[^\s]*\Z" % domains
+    lines = long_lines()
+
+    def regex_test(line):
+        # the way the default autoaction used to test web paths
+        return re.search(domain_regex, line, re.IGNORECASE)
+
+    agree = sum(bool(regex_test(line)) == has_known_tld(line) for line in lines)
+    regex_time = timeit(regex_test, lines, repeat=1)
+    tld_time = timeit(has_known_tld, lines)
+    print('domain: {} lines, average length {:.0f}'.format(len(lines), sum(map(len, lines)) / len(lines)))
+    print('  alternation regex  {:10.3f} ms'.format(regex_time * 1000))
+    print('  has_known_tld      {:10.3f} ms  ({:.0f}x faster)'.format(tld_time * 1000, regex_time / tld_time))
+    print('  same answer on {} of {} lines'.format(agree, len(lines)))
+
+
+def bench_extract():
+    from extract import terminators, url_pattern, find_at, iter_links
+    links = {
+        'visit https://github.com today': ['https://github.com'],
+        'see http://example.org/a?b=c and ~/tmp/file.txt, "c:\\tmp\\x.txt";':
+            ['http://example.org/a?b=c', '~/tmp/file.txt', 'c:\\tmp\\x.txt'],
+        'open (./x/y) and ../z': ['./x/y', '../z'],
+        '</div>': [], '<p>hello</p>': [], 'foo(a/2': [], 'and/or': [], '16/9': [],
+        'a / 2': [], 'x //= 2': [], 'x = y /2': [], "'\\n'": [], "'\\t '": [],
+    }
+    for text, expected in links.items():
+        assert [url for start, end, url in iter_links(text)] == expected, text
+    assert find_at('visit https://github.com today', 7)[2] == 'https://github.com'
+    assert find_at('see foo/bar.txt', 6)[2] == 'foo/bar.txt'
+
+    lines = long_lines()
+    cursors = [(line, len(line) // 2) for line in lines]
+
+    def char_loop(item):
+        # the way selection() used to expand the cursor, one substr() per character;
+        # slicing a str here is much cheaper than a call into the sublime API
+        line, col = item
+        start = end = col
+        while start > 0 and not line[start - 1:start] in terminators:
+            start -= 1
+        while end < len(line) and not line[end:end + 1] in terminators:
+            end += 1
+        for match in url_pattern.finditer(line[start:end]):
+            if match.span('url')[0] < col - start < match.span('url')[1]:
+                return match.group('url')
+
+    loop_time = timeit(char_loop, cursors)
+    find_time = timeit(lambda item: find_at(*item), cursors)
+    print('extract: cursor in the middle of {} long lines'.format(len(lines)))
+    print('  character loop     {:10.3f} ms'.format(loop_time * 1000))
+    print('  find_at            {:10.3f} ms  ({:.0f}x faster)'.format(find_time * 1000, loop_time / find_time))
+
+    text = '\n'.join(['see http://example.org/a?b=c and ~/tmp/file.txt, "c:\\tmp\\x.txt";',
+                      '    if a > b: return a * 2  # no link here'] * 50000)
+    count = len(list(iter_links(text)))
+    scan_time = timeit(lambda text: list(iter_links(text)), [text], repeat=1)
+    print('  iter_links         {:10.3f} ms  ({} links in {} lines)'.format(scan_time * 1000, count, text.count('\n') + 1))
+
+
+def bench_spec():
+    if 'sublime' not in sys.modules:
+        try:
+            import sublime  # noqa: F401
+        except ImportError:
+            # spec.py only needs sublime for its plugin hooks
+            sys.modules['sublime'] = types.ModuleType('sublime')
+    from spec import SPEC, Specification, _system
+
+    def merge_get_spec(intention, path, cwd=None, app=None, title=None):
+        # the way get_spec used to fill a template, one merge per token
+        spec = SPEC[intention][_system]
+
+        def merge(target, token, source):
+            if source is None:
+                return target
+            if isinstance(source, Specification):
+                source = source.args
+            if not isinstance(source, list):
+                source = [source]
+            source_str = ' '.join(s if s else '""' for s in source)
+            merged = []
+            for arg in target:
+                if arg == '*__{}__*'.format(token):
+                    merged.extend(source)
+                else:
+                    merged.append(arg.replace('<__{}__>'.format(token), source_str))
+            return merged
+
+        spec = merge(spec, 'path', path)
+        spec = merge(spec, 'app', app)
+        spec = merge(spec, 'title', title or '')
+        return Specification(spec, cwd=cwd)
+
+    # the chains built by the actions of open_url.py
+    chains = {
+        'terminal keep open': [('shell_keep_open', {}), ('terminal', {})],
+        'edit in new window': [('detach_run', {}), ('shell', {})],
+        'empty shell': [('set_title', {'title': 'tmp'}), ('detach_run', {}), ('shell', {'cwd': '/tmp'})],
+        'reveal': [('file', {})],
+        'run custom': [('run_custom', {'app': 'vim'})],
+    }
+
+    def run_chain(get_spec, chain):
+        spec = Specification(['/usr/bin/subl', '/tmp/some file.txt'])
+        spec.quote()
+        for intention, kwargs in chain:
+            spec = get_spec(intention, spec, **kwargs)
+        return spec.args
+
+    print('spec: chained get_spec on {}, 10000 times each'.format(_system))
+    for name, chain in sorted(chains.items()):
+        if any(_system not in SPEC[intention] for intention, _ in chain):
+            print('  {:20} unsupported'.format(name))
+            continue
+        assert run_chain(merge_get_spec, chain) == run_chain(Specification.get_spec, chain)
+        items = [chain] * 10000
+        merge_time = timeit(lambda chain: run_chain(merge_get_spec, chain), items)
+        compiled_time = timeit(lambda chain: run_chain(Specification.get_spec, chain), items)
+        print('  {:20} merge {:8.3f} ms, compiled {:8.3f} ms ({:.1f}x faster)'.format(
+            name, merge_time * 1000, compiled_time * 1000, merge_time / compiled_time))
+
+
+def bench_registry():
+    # the registry and the singleton store, driven by a fake desktop
+    from window_registry import WindowRegistry, SingletonStore, FakeBackend
+
+    backend = FakeBackend()
+    first = backend.create('Editor', 'a.txt')
+    registry = WindowRegistry(backend)
+    registry.start()
+    assert registry.find('Editor') == first
+    second = backend.create('Editor', 'b.txt')
+    assert registry.find('Editor') == first, 'the oldest window of a class wins'
+    assert registry.find(window_title='b.txt') == second
+    backend.rename(second, 'c.txt')
+    assert registry.find(window_title='b.txt') is None and registry.find('Editor', 'c.txt') == second
+    backend.close(first)
+    assert registry.find('Editor') == second and not registry.matches(first)
+
+    # a window shown before the marker, or renamed after it, is not new
+    marker = registry.marker()
+    assert registry.wait_for_new(marker, 'Editor', timeout=0.05) is None
+    backend.rename(second, 'd.txt')
+    assert registry.wait_for_new(marker, 'Editor', timeout=0.05) is None
+    timer = threading.Timer(0.05, backend.create, ('Editor', 'e.txt'))
+    timer.start()
+    start = time.time()
+    third = registry.wait_for_new(marker, 'Editor', timeout=5)
+    assert third is not None and registry.title(third) == 'e.txt' and time.time() - start < 1
+    fourth = backend.create('Editor', 'f.txt')
+    assert registry.wait_for_new(marker, 'Editor', timeout=0) == fourth, 'the newest window wins'
+    assert registry.wait_for_new(marker, window_title='e.txt', timeout=0) == third
+
+    # least recently used ids go first, closed windows are dropped, a flush saves the rest
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'singletons.json')
+        store = SingletonStore(registry, path, capacity=2, flush_delay=60)
+        store.set('one', {'hWnd': second, 'title': 'd.txt'})
+        store.set('two', {'hWnd': third, 'title': 'e.txt'})
+        assert store.get('one')['hWnd'] == second
+        store.set('three', {'hWnd': fourth, 'title': 'f.txt'})
+        assert store.get('two') is None and store.get('one') is not None
+        assert store.get('one', window_class='Other') is None, 'a window of another class is dropped'
+        backend.close(fourth)
+        store.flush()
+        assert store.timer is None and not store.dirty
+        loaded = SingletonStore(registry, path)
+        loaded.load()
+        assert list(loaded.windows) == [], 'the only saved window was closed'
+        store.set('two', {'hWnd': third, 'title': 'e.txt'})
+        store.flush()
+        loaded.load()
+        assert loaded.get('two') == {'hWnd': third, 'title': 'e.txt'}
+    finally:
+        shutil.rmtree(directory)
+    registry.stop()
+
+    # a lookup among many windows
+    backend = FakeBackend()
+    registry = WindowRegistry(backend)
+    registry.start()
+    windows = [backend.create('Class{}'.format(i % 50), 'Title {}'.format(i)) for i in range(5000)]
+    titles = ['Title {}'.format(i) for i in range(0, 5000, 7)]
+
+    def scan(title):
+        # what enumerating every window of the desktop costs
+        for hWnd, window_class, window_title in backend.enumerate():
+            if window_title == title:
+                return hWnd
+
+    assert all(scan(title) == registry.find(window_title=title) for title in titles)
+    scan_time = timeit(scan, titles)
+    find_time = timeit(lambda title: registry.find(window_title=title), titles)
+    print('registry: {} lookups among {} windows, checks passed'.format(len(titles), len(windows)))
+    print('  enumerate          {:8.3f} ms'.format(scan_time * 1000))
+    print('  find               {:8.3f} ms  ({:.0f}x faster)'.format(find_time * 1000, scan_time / find_time))
+
+
+benchmarks = {
+    'domain': bench_domain,
+    'extract': bench_extract,
+    'registry': bench_registry,
+    'spec': bench_spec,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or sorted(benchmarks):
+        benchmarks[name]()
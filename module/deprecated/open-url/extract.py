@@ -0,0 +1,77 @@
+# noqa: D, V
+# Find urls and paths in text, see OpenUrlMoreCommand.selection.
+#
+# The pattern is compiled once. A line is split at the terminators with
+# str.rfind and one regex search instead of looking at one character at a
+# time, and a whole buffer is scanned segment by segment in a single pass.
+
+import re
+
+# a link never starts inside a word, a number, another path or an html tag
+# ex: and/or, 16/9, foo(a/2, </div>
+boundary = r'(?<![\w<.~:\\/])'
+
+# match url ex: http://xxx, https://xxx/xxx
+# this match not accept space
+web_url = boundary + r'https?://[^ ]+'
+
+# match home and relative path ex: ~/xxx, ./xxx, ../xxx
+# this match not accept space
+home_url = boundary + r'(?:~|\.\.?)[\\/][^ ]*'
+
+# match absolute path ex: c:/xxx, E:\xxx, /xxx
+# this match is accept only one space inside word
+abs_url = boundary + r'([A-Z]:)?[\\/](?:[^ ]| (?! |https?:))*'
+
+# match relative path ex: xxx/xxx, xxx\xxx, only around the cursor, see find_at
+# this match not accept space
+file_url = r'([^ \\/]+[\\/])+([^ \\/]+)?'
+
+# unfold surrounding symbol
+merge_url = r'(\[)?(\()?(?P<url>{0})(?(2)\))(?(1)\])'
+
+# compose those matches together, the url first so its host is not a path
+url_pattern = re.compile(merge_url.format('|'.join([web_url, home_url, abs_url])), re.I)
+file_pattern = re.compile(merge_url.format(file_url), re.I)
+
+# a url or a path never crosses these
+terminators = '\t"\'><,;'
+_terminator = re.compile('[{}]'.format(re.escape(terminators)))
+_segment = re.compile('[^{}\r\n]+'.format(re.escape(terminators)))
+# code that looks like a path: a division like `a / 2`, `x //= 2` or `x /2`,
+# or escape sequences like '\n' or '\t '
+_not_link = re.compile(r'(?:[\\/]+[=*]?(?:\s.*|[\d.]+(?:\s.*)?)?|(?:\\(?:[abfnrtv0]|x[0-9a-fA-F]{2})\s*)+)\Z', re.S)
+
+
+def segment_at(line, col):
+    """Return the (start, end) of the text around `col` between two terminators."""
+    start = max(line.rfind(t, 0, col) for t in terminators) + 1
+    match = _terminator.search(line, col)
+    return start, match.start() if match else len(line)
+
+
+def find_at(line, col):
+    """Return the (start, end, text) of the url or path around `col` in `line`.
+
+    If there is none, return the whole text between the terminators, stripped.
+    """
+    start, end = segment_at(line, col)
+    for pattern in (url_pattern, file_pattern):
+        for match in pattern.finditer(line, start, end):
+            url_start, url_end = match.span('url')
+            if url_start <= col <= url_end and not _not_link.match(match.group('url')):
+                return url_start, url_end, match.group('url')
+    return start, end, line[start:end].strip()
+
+
+def iter_links(text):
+    """Yield the (start, end, url) of all the urls and paths in `text`."""
+    for segment in _segment.finditer(text):
+        start, end = segment.span()
+        # every link has a slash, most segments of a source file have none
+        if text.find('/', start, end) == -1 and text.find('\\', start, end) == -1:
+            continue
+        for match in url_pattern.finditer(text, start, end):
+            url_start, url_end = match.span('url')
+            if not _not_link.match(match.group('url')):
+                yield url_start, url_end, match.group('url')
@@ -8,17 +8,19 @@ import sublime
 import sublime_plugin
 
 import os
+import html
 import sys
-import platform
-import re
-import fnmatch
 import urllib
 import urllib.parse
 import webbrowser
 
 sys.path.insert(0, os.path.dirname(__file__))
-from domain import domains
-from spec import Specification, WindowSingleton
+from spec import Specification, WindowSingleton, launcher
+# spec.py is not a plugin by itself, sublime calls its hooks from here
+from spec import plugin_loaded, plugin_unloaded  # noqa: F401
+from autoaction import AutoactionMatcher
+from extract import find_at, iter_links
+from resolve import candidates, resolve_async
 
 _debug = False
 
@@ -28,13 +30,32 @@ def debug(*args):
         print(*args)
 
 
+_autoaction_matcher = None
+
+
+def reset_autoaction_matcher():
+    global _autoaction_matcher
+    _autoaction_matcher = None
+
+
+def autoaction_matcher():
+    # compiled once, and again only when open_url.sublime-settings changes
+    global _autoaction_matcher
+    if _autoaction_matcher is None:
+        config = sublime.load_settings("open_url.sublime-settings")
+        config.clear_on_change('autoaction_matcher')
+        config.add_on_change('autoaction_matcher', reset_autoaction_matcher)
+        _autoaction_matcher = AutoactionMatcher(config.get('autoactions', []) + ActionDispitch.default_autoinfo)
+    return _autoaction_matcher
+
+
 class ActionDispitch:
     default_autoinfo = [
         {'type': 'file', 'action': 'file_menu'},
         {'type': 'folder', 'action': 'folder_menu'},
         {'type': 'web', 'pattern': ['*://*'], 'action': 'browse'},
         # list of known domains for short urls, like ironcowboy.co
-        {'type': 'web', 'regex': r"\w[^\s]*\.(?:%s)[^\s]*\Z" % domains, 'action': 'browse_http'},
+        {'type': 'web', 'domain': True, 'action': 'browse_http'},
         {'action': 'browse_google'},
     ]
 
@@ -49,7 +70,7 @@ class ActionDispitch:
         return spec
 
     def finan_spec(self, spec):
-        if self.autoinfo.get('singleton', False) and WindowSingleton:
+        if self.autoinfo.get('singleton', False) and WindowSingleton.available():
             title = self.autoinfo.get('title')
             if title == '$BASE_NAME':
                 title = os.path.basename(self.path)
@@ -63,44 +84,11 @@ class ActionDispitch:
         return spec
 
     def get_autoinfo(self):
-        config = sublime.load_settings("open_url.sublime-settings")
-
-        selected = []
-        # see if there's already an action defined for this file
-        for auto in config.get('autoactions', []) + self.default_autoinfo:
-            # see if this line applies to this opperating system
-            oscheck = ('os' not in auto
-                       or auto['os'] == 'win' and platform.system() == 'Windows'
-                       or auto['os'] == 'linux' and platform.system() == 'Linux'
-                       or auto['os'] == 'mac' and platform.system() == 'Darwin'
-                       or auto['os'] == 'posix' and (platform.system() == 'Darwin'
-                                                     or platform.system() == 'Linux')
-                       )
-
-            # if the line is for this OS, then check to see if we have a file pattern match
-            
-            for pattern in auto.get('pattern', ['*']):
-                match = all([oscheck,
-                             fnmatch.fnmatch(self.path, pattern),
-                             not (auto.get('type') and auto['type'] != self.type),
-                             not (auto.get('regex') and not re.search(auto['regex'],
-                                                                      self.path, re.IGNORECASE))
-                             ])
-                if match:
-                    selected.append((
-                                    -({'any': 0, 'posix': 1}).get(auto.get('os', 'any'), 2),
-                                    -(sum(2 if c == '*' else 1 for c in pattern)
-                                        - int('regex' in auto) * 10),
-                                    -int('type' in auto),
-                                    auto
-                                    ))
-                    break
-        debug(selected)
-        # give higher priority to the exact option
-        assert(selected)
-        selected = sorted(selected)
-        return selected[0][3]
-        
+        autoinfo = autoaction_matcher().match(self.type, self.path)
+        debug(autoinfo)
+        # the last default autoinfo matches everything
+        assert(autoinfo)
+        return autoinfo
 
     def do_action(self, action=None, **kwargs):
         action = action or self.autoinfo['action']
@@ -191,6 +179,8 @@ class ActionDispitch:
 
 
     def action_bring_browse(self):
+        if not WindowSingleton.available():
+            return
         browser_class = {
             'firefox': 'MozillaWindowClass',
             'chrome': 'Chrome_WidgetWin_1',
@@ -204,7 +194,9 @@ class ActionDispitch:
     def action_browse(self):
         using_browser = self.autoinfo.get('browser', 'chrome')
         self.do_action('bring_browse')
-        webbrowser.get(using_browser).open_new_tab(self.path)
+        path = self.path
+        # after the browser is brought to the top, on the launcher thread
+        launcher.submit(lambda: webbrowser.get(using_browser).open_new_tab(path))
 
     def action_browse_http(self):
         if "://" not in self.path:
@@ -293,86 +285,250 @@ class OpenUrlMoreCommand(sublime_plugin.TextCommand):
         if (url.startswith("\"") & url.endswith("\"")) | (url.startswith("\'") & url.endswith("\'")):
             url = url[1:-1]
 
-        # find the relative path to the current file 'google.com'
-        try:
-            relative_path = os.path.normpath(os.path.join(os.path.dirname(self.view.file_name()), url))
-        except (TypeError, AttributeError):
-            relative_path = None
+        # relative paths are relative to the current file
+        file_name = self.view.file_name()
+        base_dir = os.path.dirname(file_name) if file_name else None
 
         # debug info
-        debug("open_url debug : ", [url, relative_path])
+        debug("open_url debug : ", candidates(url, base_dir))
 
         # if this is a directory, show it (absolute or relative)
         # if it is a path to a file, open the file in sublime (absolute or relative)
         # if it is a URL, open in browser
         # otherwise google it
-        if os.path.isdir(url):
-            ActionDispitch(self.view, 'folder', url).do_action()
-        
-        elif os.path.isdir(os.path.expanduser(url)):
-            ActionDispitch(self.view, 'folder', os.path.expanduser(url)).do_action()
+        # the paths are probed in a thread, actions run back on the main thread
+        def on_done(path_type, path):
+            sublime.set_timeout(lambda: ActionDispitch(self.view, path_type, path).do_action(), 0)
 
-        elif relative_path and os.path.isdir(relative_path):
-            ActionDispitch(self.view, 'folder', relative_path).do_action()
-        
-        elif os.path.exists(url):
-            ActionDispitch(self.view, 'file', url).do_action()
+        def on_timeout():
+            sublime.set_timeout(lambda: sublime.status_message(
+                "open_url: looking up '{}' took too long".format(url)), 0)
 
-        elif os.path.exists(os.path.expanduser(url)):
-            ActionDispitch(self.view, 'file', os.path.expanduser(url)).do_action()
-        
-        elif relative_path and os.path.exists(relative_path):
-            ActionDispitch(self.view, 'file', relative_path).do_action()
-        
-        else:
-            ActionDispitch(self.view, 'web', url).do_action()
+        config = sublime.load_settings("open_url.sublime-settings")
+        resolve_async(url, base_dir, on_done, on_timeout, timeout=config.get('resolve_timeout', 1.0))
 
 
     # pulls the current selection or url under the cursor
     def selection(self):
-        # new method to strongly enhance finding path-like string
         s = self.view.sel()[0]
 
-        # expand selection to possible URL
-        start = s.a
-        end = s.b
+        # if nothing is selected, expand selection to the url or path around the cursor
+        if s.empty():
+            line_region = self.view.line(s.a)
+            line = self.view.substr(line_region)
+            return find_at(line, s.a - line_region.a)[2]
 
-        # match absolute path ex: c:/xxx, E:\xxx, /xxx
-        # this match is accept only one space inside word
-        abs_url = r'([A-Z]:)?[\\/](?:[^ ]| (?! |https?:))*'
-        
-        # match url path ex: http://xxx, xxx/xxx, xxx\xxx
-        # this match not accept space
-        file_url = r'(https?://)?([^ \\/]+[\\/])+([^ \\/]+)?'
-        
-        # unfold surrounding symbol
-        merge_url = r'(\[)?(\()?(?P<url>{0})(?(2)\))(?(1)\])'
+        # grab the URL
+        return self.view.substr(s).strip()
 
-        # compose those matches together
-        url_pattern = re.compile(merge_url.format('|'.join([abs_url, file_url])), re.I)
 
+class OpenUrlListLinksCommand(sublime_plugin.TextCommand):
+    """ list all urls and paths in the file, open the chosen one """
 
-        # if nothing is selected, expand selection to nearest terminators
-        if (start == end):
-            line_region = self.view.line(start)
-            terminator = list('\t\"\'><,;')
+    def run(self, edit):
+        view = self.view
+        links = list(iter_links(view.substr(sublime.Region(0, view.size()))))
+        if not links:
+            sublime.status_message('open_url: no links in this file')
+            return
+        items = [[url, 'line {}'.format(view.rowcol(start)[0] + 1)] for start, end, url in links]
+        selections = list(view.sel())
 
-            # move the selection back to the start of the url
-            while (start > line_region.a
-                   and not self.view.substr(start - 1) in terminator):
-                start -= 1
+        def restore():
+            view.sel().clear()
+            view.sel().add_all(selections)
+            view.show(selections[0] if selections else 0)
 
-            # move end of selection forward to the end of the url
-            while (end < line_region.b
-                   and not self.view.substr(end) in terminator):
-                end += 1
+        def highlight(index):
+            start, end, url = links[index]
+            view.sel().clear()
+            view.sel().add(sublime.Region(start, end))
+            view.show_at_center(start)
 
-            url = self.view.substr(sublime.Region(start, end))
-            for match in url_pattern.finditer(url):
-                # make sure match at the cursor position
-                if match.span('url')[0] < s.a - line_region.a < match.span('url')[1]:
-                    return match.group('url')
+        def done(index):
+            restore()
+            if index != -1:
+                view.run_command('open_url_more', {'url': links[index][2]})
 
-        # grab the URL
-        return self.view.substr(sublime.Region(start, end)).strip()
+        view.window().show_quick_panel(items, done, 0, 0, highlight)
+
+
+# the links of each view are kept as hidden regions, sublime moves them on every edit,
+# so only the lines around the selections are scanned again after typing
+_links_key = 'open_url_links'
+_indexed_views = set()
+_view_sizes = {}
+_pending_rescans = {}
+# the selection starts before a local edit, a paste may replace more than it inserts
+_edit_starts = {}
+
+# commands which only change the text around the selections
+_local_edits = {'insert', 'insert_snippet', 'left_delete', 'right_delete', 'delete_word',
+                'paste', 'cut', 'reindent', 'toggle_comment'}
 
+
+def open_url_setting(name, default):
+    return sublime.load_settings("open_url.sublime-settings").get(name, default)
+
+
+def scan_links(view, region):
+    return [sublime.Region(region.a + start, region.a + end)
+            for start, end, url in iter_links(view.substr(region))]
+
+
+def index_view(view):
+    view.add_regions(_links_key, scan_links(view, sublime.Region(0, view.size())), '', '', sublime.HIDDEN)
+    _indexed_views.add(view.id())
+    _view_sizes[view.id()] = view.size()
+
+
+def index_view_async(view):
+    # a whole buffer takes about a second per 100k lines, not on the ui thread
+    def index():
+        if view.is_valid():
+            index_view(view)
+    sublime.set_timeout_async(index, 0)
+
+
+def schedule_index_view(view, delay=200):
+    # a burst of edits, like a replace all, is scanned once
+    _pending_rescans[view.id()] = _pending_rescans.get(view.id(), 0) + 1
+
+    def rescan():
+        if view.id() not in _pending_rescans:
+            # closed meanwhile
+            return
+        _pending_rescans[view.id()] -= 1
+        if _pending_rescans[view.id()] == 0:
+            del _pending_rescans[view.id()]
+            index_view_async(view)
+    sublime.set_timeout(rescan, delay)
+
+
+def dirty_lines(view, grown, starts=None):
+    # the lines of each selection, from the lower of its start before the edit
+    # and the start of the text inserted before it
+    selections = list(view.sel())
+    if starts is not None and len(selections) > 1:
+        # the earlier edits moved the later starts, cover them all
+        begin = min(list(starts) + [sel.begin() - grown for sel in selections])
+        return [view.line(sublime.Region(max(0, begin), selections[-1].end()))]
+    lines = []
+    for sel in selections:
+        begin = sel.begin() - grown
+        if starts:
+            begin = min(begin, starts[0])
+        line = view.line(sublime.Region(max(0, begin), sel.end()))
+        if lines and lines[-1].end() >= line.begin():
+            lines[-1] = lines[-1].cover(line)
+        else:
+            lines.append(line)
+    return lines
+
+
+def update_index(view):
+    size = view.size()
+    grown = max(0, size - _view_sizes.get(view.id(), size))
+    _view_sizes[view.id()] = size
+    lines = dirty_lines(view, grown, _edit_starts.pop(view.id(), None))
+
+    def touched(link):
+        return any(link.end() >= line.begin() and link.begin() <= line.end() for line in lines)
+
+    kept, old = [], []
+    for link in view.get_regions(_links_key):
+        # the text of a link may have been deleted
+        if link.empty():
+            old.append(link)
+        else:
+            (old if touched(link) else kept).append(link)
+    new = [link for line in lines for link in scan_links(view, line)]
+    if new == old:
+        return
+    view.add_regions(_links_key, sorted(kept + new, key=lambda link: link.begin()), '', '', sublime.HIDDEN)
+
+
+def links_in(view, region):
+    """Return the links which overlap `region`, or contain it if it is empty."""
+    if view.id() in _indexed_views:
+        links = [link for link in view.get_regions(_links_key) if not link.empty()]
+    else:
+        links = scan_links(view, view.line(region))
+    if region.empty():
+        return [link for link in links if link.begin() <= region.a <= link.end()]
+    return [link for link in links if link.begin() < region.end() and region.begin() < link.end()]
+
+
+class OpenUrlLinkIndex(sublime_plugin.EventListener):
+    def on_load(self, view):
+        if open_url_setting('link_index', True):
+            index_view_async(view)
+
+    def on_activated(self, view):
+        if view.id() not in _indexed_views and open_url_setting('link_index', True):
+            index_view_async(view)
+
+    def on_close(self, view):
+        _indexed_views.discard(view.id())
+        _view_sizes.pop(view.id(), None)
+        _pending_rescans.pop(view.id(), None)
+        _edit_starts.pop(view.id(), None)
+
+    def on_text_command(self, view, command_name, args):
+        if view.id() in _indexed_views and command_name in _local_edits:
+            _edit_starts[view.id()] = [sel.begin() for sel in view.sel()]
+
+    def on_modified(self, view):
+        if view.id() not in _indexed_views:
+            return
+        command = view.command_history(0, True)[0]
+        if command in _local_edits:
+            update_index(view)
+        else:
+            _edit_starts.pop(view.id(), None)
+            schedule_index_view(view)
+
+    def on_post_text_command(self, view, command_name, args):
+        # undo and redo may change any part of the view
+        if view.id() in _indexed_views and command_name in ('undo', 'redo', 'redo_or_repeat', 'soft_undo', 'soft_redo'):
+            schedule_index_view(view)
+
+    def on_hover(self, view, point, hover_zone):
+        if hover_zone != sublime.HOVER_TEXT or view.id() not in _indexed_views:
+            return
+        if not open_url_setting('hover_links', False):
+            return
+        links = links_in(view, sublime.Region(point))
+        if not links:
+            return
+        url = view.substr(links[0])
+
+        def navigate(href):
+            view.hide_popup()
+            view.run_command('open_url_more', {'url': url})
+        content = '<a href="open">{}</a>'.format(html.escape(url))
+        view.show_popup(content, sublime.HIDE_ON_MOUSE_MOVE_AWAY, point, 600, 200, navigate)
+
+
+class OpenUrlSelectedLinksCommand(sublime_plugin.TextCommand):
+    """ open every link under the selections, each distinct link once """
+
+    def run(self, edit):
+        urls = []
+        for sel in self.view.sel():
+            links = links_in(self.view, sel)
+            if links:
+                found = [self.view.substr(link) for link in links]
+            elif not sel.empty():
+                # a selected text without a link, like a domain, is opened as is
+                found = [self.view.substr(sel).strip()]
+            else:
+                found = []
+            for url in found:
+                if url and url not in urls:
+                    urls.append(url)
+        if not urls:
+            sublime.status_message('open_url: no links under the selections')
+            return
+        for url in urls:
+            self.view.run_command('open_url_more', {'url': url})
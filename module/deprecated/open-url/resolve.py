@@ -0,0 +1,84 @@
+# noqa: D, V
+# Decide whether a url is a folder, a file or a web address, see OpenUrlMoreCommand.run.
+#
+# The url may be absolute, start with '~', or be relative to the current
+# file. Every candidate path is probed with one os.stat, and the results are
+# cached for a few seconds. resolve_async runs the probes in a thread, so a
+# slow disk or a network mount never blocks the UI thread.
+
+import os
+import stat
+import time
+import threading
+
+# seconds a probe result is trusted
+ttl = 2.0
+
+# {path: (expires, 'folder', 'file' or None)}
+_cache = {}
+
+
+def candidates(url, base_dir=None):
+    """Return the paths `url` may refer to, in the order they are tried."""
+    paths = [url, os.path.expanduser(url)]
+    if base_dir:
+        paths.append(os.path.normpath(os.path.join(base_dir, url)))
+    unique = []
+    for path in paths:
+        if path not in unique:
+            unique.append(path)
+    return unique
+
+
+def probe(path):
+    now = time.time()
+    cached = _cache.get(path)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    try:
+        kind = 'folder' if stat.S_ISDIR(os.stat(path).st_mode) else 'file'
+    except (OSError, ValueError):
+        kind = None
+    if len(_cache) > 256:
+        for key, value in list(_cache.items()):
+            if value[0] <= now:
+                _cache.pop(key, None)
+    _cache[path] = (now + ttl, kind)
+    return kind
+
+
+def resolve(url, base_dir=None):
+    """Return (path type, path), a folder wins over a file, and 'web' if there is neither."""
+    probed = [(path, probe(path)) for path in candidates(url, base_dir)]
+    for wanted in ('folder', 'file'):
+        for path, kind in probed:
+            if kind == wanted:
+                return wanted, path
+    return 'web', url
+
+
+def resolve_async(url, base_dir, on_done, on_timeout, timeout=1.0):
+    """Call on_done(path type, path) from a thread, or on_timeout() if the probes take too long.
+
+    A probe which times out still fills the cache when it returns, so trying again later is fast.
+    """
+    lock = threading.Lock()
+    finished = []
+
+    def finish(callback, *args):
+        with lock:
+            if finished:
+                return
+            finished.append(True)
+        timer.cancel()
+        callback(*args)
+
+    def work():
+        finish(on_done, *resolve(url, base_dir))
+
+    timer = threading.Timer(timeout, finish, (on_timeout,))
+    timer.daemon = True
+    timer.start()
+    worker = threading.Thread(target=work)
+    worker.daemon = True
+    worker.start()
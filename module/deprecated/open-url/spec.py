@@ -1,11 +1,16 @@
 # noqa: D, V, E241
 import sublime
 
-import ctypes
+import os
+import re
 import time
+import queue
 import platform
+import threading
 import subprocess
 
+from window_registry import WindowRegistry, SingletonStore, Win32Backend
+
 _debug = False
 
 
@@ -75,22 +80,102 @@ SPEC = {
 }
 
 
+# {intention: {'count', 'total', 'max', 'last'}} seconds from popen() until the process started
+launch_stats = {}
+
+
+def record_launch(intention, seconds):
+    stats = launch_stats.setdefault(intention, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+    stats['count'] += 1
+    stats['total'] += seconds
+    stats['max'] = max(stats['max'], seconds)
+    stats['last'] = seconds
+    debug('launch {} in {:.3f}s'.format(intention, seconds))
+
+
+def report_error(error):
+    print('open_url: {}'.format(error))
+    sublime.set_timeout(lambda: sublime.status_message('open_url: {}'.format(error)), 0)
+
+
+class Launcher:
+    """
+    Run launch jobs in order on a background thread, so the UI never waits for a
+    program to start. The started processes are polled until they exit, so
+    detached children like `nohup` never stay zombies.
+    Callbacks are called on the launcher thread.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.children = []
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, job, on_done=None, on_error=report_error):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                # a thread being stopped keeps its own queue and its sentinel
+                self.jobs = queue.Queue()
+                self.thread = threading.Thread(target=self.work, args=(self.jobs,), name='open_url launcher')
+                self.thread.daemon = True
+                self.thread.start()
+            self.jobs.put((job, on_done, on_error))
+
+    def watch(self, proc):
+        self.children.append(proc)
+
+    def reap(self):
+        self.children = [proc for proc in self.children if proc.poll() is None]
+
+    def stop(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                self.jobs.put(None)
+            self.thread = None
+
+    def work(self, jobs):
+        while True:
+            try:
+                # wake up every second while some children are still running
+                item = jobs.get(timeout=1.0 if self.children else None)
+            except queue.Empty:
+                self.reap()
+                continue
+            if item is None:
+                break
+            job, on_done, on_error = item
+            try:
+                result = job()
+            except Exception as error:
+                if on_error:
+                    on_error(error)
+            else:
+                if on_done:
+                    on_done(result)
+            self.reap()
+
+
+launcher = Launcher()
+
+
 class Specification:
     dry_run = False
 
-    def __init__(self, args, cwd=None, hidden=False):
+    def __init__(self, args, cwd=None, hidden=False, intention=None):
         self.args = args
         self.hidden = hidden
         self.cwd = cwd
+        self.intention = intention
 
     def quote(self):
         self.args = ['"{}"'.format(arg) for arg in self.args]
 
-    def popen(self):
-        if debug:
-            print("popen cmd: %s" % self.args)
+    def spawn(self, cwd=None, submitted=None):
+        """ start the process now and return it, or None on dry run """
+        debug("popen cmd: %s" % self.args)
         if self.dry_run:
-            return
+            return None
 
         startupinfo = None
         if self.hidden:
@@ -99,186 +184,217 @@ class Specification:
             startupinfo.dwFlags |= _winapi.STARTF_USESHOWWINDOW
             startupinfo.wShowWindow = _winapi.SW_HIDE
 
-        subprocess.Popen(self.args[0] if len(self.args) == 1 else self.args,
-                         cwd=self.cwd, startupinfo=startupinfo)
+        start = time.time() if submitted is None else submitted
+        proc = subprocess.Popen(self.args[0] if len(self.args) == 1 else self.args,
+                                cwd=cwd or self.cwd, startupinfo=startupinfo)
+        record_launch(self.intention, time.time() - start)
+        launcher.watch(proc)
+        return proc
+
+    def popen(self, cwd=None, on_done=None, on_error=report_error):
+        """ start the process on the launcher thread, on_done(proc) is called once started """
+        submitted = time.time()
+        launcher.submit(lambda: self.spawn(cwd=cwd, submitted=submitted), on_done, on_error)
 
     @classmethod
     def get_spec(cls, intention, path, cwd=None, app=None, title=None):
-        if not SPEC.get(intention):
-            raise Exception('unrecognized intention "{}"'.format(intention))
-        if not SPEC[intention].get(platform.system()):
-            raise Exception('unsupported os')
-        spec = SPEC[intention][platform.system()]
-        
-        def merge(target, token, source):
-            if source is None:
-                return target
-            if isinstance(source, cls):
-                source = source.args
-            if not isinstance(source, list):
-                source = [source]
-            source_str = ' '.join(s if s else '""' for s in source)
-            merged = []
-            for arg in target:
-                if arg == '*__{}__*'.format(token):
-                    merged.extend(source)
-                else:
-                    merged.append(arg.replace('<__{}__>'.format(token), source_str))
-            return merged
-
-        spec = merge(spec, 'path', path)
-        spec = merge(spec, 'app', app)
-        spec = merge(spec, 'title', title or '')
-        hidden = intention == 'shell' and platform.system() == 'Windows'
-        return cls(spec, cwd=cwd, hidden=hidden)
-
-
-
-
-if platform.system() == 'Windows':
-    EnumWindows = ctypes.windll.user32.EnumWindows
-    EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.c_bool,
-                                         ctypes.POINTER(ctypes.c_int),
-                                         ctypes.POINTER(ctypes.c_int))
-    GetClassName = ctypes.windll.user32.GetClassNameW
-    GetWindowText = ctypes.windll.user32.GetWindowTextW
-    GetWindowTextLength = ctypes.windll.user32.GetWindowTextLengthW
-    IsWindowVisible = ctypes.windll.user32.IsWindowVisible
-    SW_MINIMIZE = 6
-    SW_RESTORE = 9
-    ShowWindow = ctypes.windll.user32.ShowWindow
-    GetForegroundWindow = ctypes.windll.user32.GetForegroundWindow
-
-    def get_window_class(hWnd):
-        buff = ctypes.create_unicode_buffer(100)
-        GetClassName(hWnd, buff, 99)
-        return buff.value
-
-
-    def get_window_title(hWnd):
-        length = GetWindowTextLength(hWnd)
-        buff = ctypes.create_unicode_buffer(length + 1)
-        GetWindowText(hWnd, buff, length + 1)
-        return buff.value
-
-
-    def list_window(match_class=None, match_title=None):
-        hWnds = []
-
-        def callback(hWnd, lParam):
-            if IsWindowVisible(hWnd):
-                hWnds.append(ctypes.addressof(hWnd.contents))
-            return True
-        EnumWindows(EnumWindowsProc(callback), 0)
-
-        if match_class is not None:
-            hWnds = filter(lambda hWnd: get_window_class(hWnd) == match_class, hWnds)
-        if match_title is not None:
-            hWnds = filter(lambda hWnd: get_window_title(hWnd) == match_title, hWnds)
-        return list(hWnds)
-
-
-    # reference: https://gist.github.com/EBNull/1419093
-    def forceFocus(wnd):
-        if GetForegroundWindow() == wnd:
-            return True
-        ShowWindow(wnd, SW_MINIMIZE)
-        ShowWindow(wnd, SW_RESTORE)
-
-
-    class WindowSingleton:
-        _hash = None
-
-        def __init__(self, cmd, id=None,
-                     window_title=None, window_class=None,
-                     title_instance=False, class_instance=False):
-            assert(any([id, window_title, window_class]))
-            self.cmd = cmd
-            self.id = id
-            self.window_title = window_title
-            self.window_class = window_class
-
-            # if ture, ensure() is not create window for same title more than one
-            self.title_instance = title_instance
-
-            # if ture, ensure() is not create window for same class more than one
-            self.class_instance = class_instance
-            debug(self.window_title, self.window_class, self.title_instance, self.class_instance)
-
-        def do_create(self):
-            if isinstance(self.cmd, Specification):
-                self.cmd.popen()
-            elif callable(self.cmd):
-                self.cmd(self)
+        args = fill(compile_spec(intention), [('path', path), ('app', app), ('title', title or '')])
+        hidden = intention == 'shell' and _system == 'Windows'
+        return cls(args, cwd=cwd, hidden=hidden, intention=intention)
+
+
+# SPEC templates are compiled once per intention into a list of operations:
+#   (LITERAL, arg)             the argument as is
+#   (SPLICE, token)            '*__token__*', replaced by all the arguments of the value
+#   (INLINE, parts, tokens)    '<__token__>' inside an argument, replaced by the value
+#                              joined by spaces; parts are the text around the tokens
+# a None value leaves its placeholder as is, so it can be filled by an outer spec
+LITERAL, SPLICE, INLINE = range(3)
+_splice_token = re.compile(r'\*__(\w+)__\*\Z')
+_inline_token = re.compile(r'<__(\w+)__>')
+_any_token = re.compile(r'\*__\w+__\*\Z|<__\w+__>')
+_system = platform.system()
+_compiled = {}
+
+
+def compile_spec(intention):
+    program = _compiled.get(intention)
+    if program is not None:
+        return program
+    if not SPEC.get(intention):
+        raise Exception('unrecognized intention "{}"'.format(intention))
+    if not SPEC[intention].get(_system):
+        raise Exception('unsupported os')
+    program = []
+    for arg in SPEC[intention][_system]:
+        splice = _splice_token.match(arg)
+        if splice:
+            program.append((SPLICE, splice.group(1)))
+            continue
+        pieces = _inline_token.split(arg)
+        if len(pieces) == 1:
+            program.append((LITERAL, arg))
+        else:
+            program.append((INLINE, pieces[0::2], pieces[1::2]))
+    _compiled[intention] = program
+    return program
+
+
+def source_args(source):
+    if isinstance(source, Specification):
+        return source.args
+    if not isinstance(source, list):
+        return [source]
+    return source
+
+
+def merge(args, token, source):
+    # fill one token of already filled arguments
+    source_str = ' '.join(s if s else '""' for s in source)
+    merged = []
+    for arg in args:
+        if arg == '*__{}__*'.format(token):
+            merged.extend(source)
+        else:
+            merged.append(arg.replace('<__{}__>'.format(token), source_str))
+    return merged
+
+
+def fill(program, values):
+    """ values are [(token, value)], a value may hold placeholders for the tokens after it """
+    sources = [(token, source_args(source)) for token, source in values if source is not None]
+    if any(_any_token.search(arg) for token, source in sources for arg in source):
+        # like a nested spec still waiting for its app: fill the tokens one
+        # after the other, so the later ones reach into the earlier values
+        args = fill(program, [])
+        for token, source in sources:
+            args = merge(args, token, source)
+        return args
+
+    # each value is converted once, to a list of arguments and to a string
+    splices, inlines = {}, {}
+    for token, source in sources:
+        splices[token] = source
+        inlines[token] = ' '.join(s if s else '""' for s in source)
+
+    args = []
+    for op in program:
+        if op[0] == LITERAL:
+            args.append(op[1])
+        elif op[0] == SPLICE:
+            token = op[1]
+            if token in splices:
+                args.extend(splices[token])
             else:
-                proc = subprocess.Popen(self.cmd, shell=True)
-                proc.wait()
-            time.sleep(0.5)
-
-        def create_window(self):
-            def get_snapshot():
-                return set(list_window(match_class=self.window_class,
-                                       match_title=self.window_title))
-
-            before = get_snapshot()
-            self.do_create()
-
-            # find the window who created recently is match the class and the title
-            delta = get_snapshot() - before
-            if delta:
-                hWnd = list(delta)[0]
-                return {'hWnd': hWnd, 'title': get_window_title(hWnd)}
-
-        def ensure(self):
-            # ensure window exist. otherwise, create new one and return its handle
-            hash_id = self.id or self.window_title or self.window_class
-            window = None
-            # try to find opened window in hash first
-            if self._hash.get(hash_id) is not None:
-                _window = self._hash.get(hash_id)
-                if all([IsWindowVisible(_window['hWnd']),        # test window exist
-                        not (self.window_title is not None and
-                             self.window_title != get_window_title(_window['hWnd'])),
-                        not (self.window_class is not None and
-                             self.window_class != get_window_class(_window['hWnd']))
-                        ]):
-                    window = _window
-            debug('window in hash: {}'.format(window))
-
-            # if this is a singlaton window,
-            # search already opened window in system who are match class and title
-            if window is None and (self.class_instance or self.title_instance):
-                # class_instance: ensure the program with window_class exist and onlyone
-                # title_instance: ensure the program with window_title exist and onlyone
-                windows = list_window(match_class=self.window_class if self.class_instance else None,
-                                      match_title=self.window_title if self.title_instance else None)
-                if windows:
-                    window = {'hWnd': windows[0], 'title': get_window_title(windows[0])}
-            debug('window exists: {}'.format(window))
-
-            if window is None:
-                window = self.create_window()
-            
-            if window is None:
-                raise Exception('unable excute program')
-
-            self._hash.set(hash_id, window)
-            # sublime.save_settings('singletion-hash.sublime-settings')
-            return window['hWnd']
-
-        def bring_top(self):
-            hWnd = self.ensure()
-            forceFocus(hWnd)
-else:
-    WindowSingleton = None
+                args.append('*__{}__*'.format(token))
+        else:
+            parts, tokens = op[1], op[2]
+            pieces = [parts[0]]
+            for token, part in zip(tokens, parts[1:]):
+                pieces.append(inlines.get(token, '<__{}__>'.format(token)))
+                pieces.append(part)
+            args.append(''.join(pieces))
+    return args
+
+
+class WindowSingleton:
+    # the windows of the desktop, None where there is no backend for the platform
+    registry = None
+
+    # the window of each singleton id
+    store = None
+
+    # seconds to wait for the window of a new program
+    create_timeout = 5.0
+
+    @classmethod
+    def available(cls):
+        return cls.registry is not None
+
+    def __init__(self, cmd, id=None,
+                 window_title=None, window_class=None,
+                 title_instance=False, class_instance=False):
+        assert(any([id, window_title, window_class]))
+        self.cmd = cmd
+        self.id = id
+        self.window_title = window_title
+        self.window_class = window_class
+
+        # if ture, ensure() is not create window for same title more than one
+        self.title_instance = title_instance
+
+        # if ture, ensure() is not create window for same class more than one
+        self.class_instance = class_instance
+        debug(self.window_title, self.window_class, self.title_instance, self.class_instance)
+
+    def do_create(self):
+        # called on the launcher thread, waiting here does not block the UI
+        if isinstance(self.cmd, Specification):
+            self.cmd.spawn()
+        elif callable(self.cmd):
+            self.cmd(self)
+        else:
+            proc = subprocess.Popen(self.cmd, shell=True)
+            proc.wait()
+
+    def create_window(self):
+        since = self.registry.marker()
+        self.do_create()
+
+        # wait for the window shown after the program started, which matches the class and the title
+        hWnd = self.registry.wait_for_new(since, window_class=self.window_class,
+                                          window_title=self.window_title, timeout=self.create_timeout)
+        if hWnd is not None:
+            return {'hWnd': hWnd, 'title': self.registry.title(hWnd)}
+
+    def ensure(self):
+        # ensure window exist. otherwise, create new one and return its handle
+        hash_id = self.id or self.window_title or self.window_class
+        window = None
+        # try to find opened window in store first
+        window = self.store.get(hash_id, window_class=self.window_class, window_title=self.window_title)
+        debug('window in store: {}'.format(window))
+
+        # if this is a singlaton window,
+        # search already opened window in system who are match class and title
+        if window is None and (self.class_instance or self.title_instance):
+            # class_instance: ensure the program with window_class exist and onlyone
+            # title_instance: ensure the program with window_title exist and onlyone
+            hWnd = self.registry.find(window_class=self.window_class if self.class_instance else None,
+                                      window_title=self.window_title if self.title_instance else None)
+            if hWnd is not None:
+                window = {'hWnd': hWnd, 'title': self.registry.title(hWnd)}
+        debug('window exists: {}'.format(window))
+
+        if window is None:
+            window = self.create_window()
+
+        if window is None:
+            raise Exception('unable excute program')
+
+        self.store.set(hash_id, window)
+        return window['hWnd']
+
+    def activate(self):
+        hWnd = self.ensure()
+        self.registry.focus(hWnd)
+
+    def bring_top(self, on_done=None, on_error=report_error):
+        launcher.submit(self.activate, on_done, on_error)
 
 
 def plugin_loaded():
-    # print(list(map(lambda x: (get_window_title(x), get_window_class(x)), list_window())))
-    if WindowSingleton:
-        WindowSingleton._hash = sublime.load_settings('singletion-hash.sublime-settings')
+    if Win32Backend is None:
+        return
+    WindowSingleton.registry = WindowRegistry(Win32Backend())
+    WindowSingleton.registry.start()
+    WindowSingleton.store = SingletonStore(WindowSingleton.registry,
+                                           os.path.join(sublime.cache_path(), 'open_url', 'singletons.json'))
+    WindowSingleton.store.load()
 
 
 def plugin_unloaded():
-    if WindowSingleton:
-        sublime.save_settings('singletion-hash.sublime-settings')
+    launcher.stop()
+    if WindowSingleton.available():
+        WindowSingleton.store.flush()
+        WindowSingleton.registry.stop()
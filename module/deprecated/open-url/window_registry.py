@@ -0,0 +1,352 @@
+# noqa: D, V
+# Track the visible top level windows, see WindowSingleton in spec.py.
+#
+# A backend reports windows when they are shown, hidden or renamed, and the
+# registry keeps them indexed by class and by title, so finding a window is a
+# dict lookup instead of enumerating every window of the desktop. A launcher
+# waits for its new window on a condition instead of sleeping.
+#
+# SingletonStore remembers the window of each WindowSingleton, and saves them
+# to a small json file from time to time.
+#
+# backends:
+#   Win32Backend    SetWinEventHook on a message loop thread, Windows only
+#   FakeBackend     windows created by hand, for tests on any platform
+
+import os
+import json
+import time
+import platform
+import threading
+import collections
+
+
+class WindowRegistry:
+    def __init__(self, backend):
+        self.backend = backend
+        # {hWnd: [class, title, sequence number]}
+        self.windows = {}
+        # {class: OrderedDict{hWnd: None}}, {title: OrderedDict{hWnd: None}}, oldest window first
+        self.by_class = {}
+        self.by_title = {}
+        self.sequence = 0
+        self.condition = threading.Condition()
+
+    def start(self):
+        self.backend.start(self)
+        for hWnd, window_class, title in self.backend.enumerate():
+            self.on_show(hWnd, window_class, title)
+
+    def stop(self):
+        self.backend.stop()
+
+    def _index(self, index, key, hWnd):
+        index.setdefault(key, collections.OrderedDict())[hWnd] = None
+
+    def _unindex(self, index, key, hWnd):
+        windows = index.get(key)
+        if windows is not None:
+            windows.pop(hWnd, None)
+            if not windows:
+                del index[key]
+
+    def on_show(self, hWnd, window_class, title):
+        with self.condition:
+            if hWnd in self.windows:
+                self.on_rename(hWnd, title)
+                return
+            self.sequence += 1
+            self.windows[hWnd] = [window_class, title, self.sequence]
+            self._index(self.by_class, window_class, hWnd)
+            self._index(self.by_title, title, hWnd)
+            self.condition.notify_all()
+
+    def on_hide(self, hWnd):
+        with self.condition:
+            window = self.windows.pop(hWnd, None)
+            if window is not None:
+                self._unindex(self.by_class, window[0], hWnd)
+                self._unindex(self.by_title, window[1], hWnd)
+
+    def on_rename(self, hWnd, title):
+        with self.condition:
+            window = self.windows.get(hWnd)
+            if window is None or window[1] == title:
+                return
+            self._unindex(self.by_title, window[1], hWnd)
+            window[1] = title
+            self._index(self.by_title, title, hWnd)
+            self.condition.notify_all()
+
+    def title(self, hWnd):
+        window = self.windows.get(hWnd)
+        return window[1] if window else None
+
+    def matches(self, hWnd, window_class=None, window_title=None):
+        window = self.windows.get(hWnd)
+        return (window is not None and
+                (window_class is None or window[0] == window_class) and
+                (window_title is None or window[1] == window_title))
+
+    def _candidates(self, window_class, window_title):
+        if window_title is not None:
+            return self.by_title.get(window_title, ())
+        if window_class is not None:
+            return self.by_class.get(window_class, ())
+        return self.windows
+
+    def find(self, window_class=None, window_title=None):
+        """ return the oldest window with this class and title, None matches any """
+        with self.condition:
+            for hWnd in self._candidates(window_class, window_title):
+                if self.matches(hWnd, window_class, window_title):
+                    return hWnd
+        return None
+
+    def marker(self):
+        """ windows shown after this marker are new for wait_for_new() """
+        with self.condition:
+            return self.sequence
+
+    def _newest_since(self, since, window_class, window_title):
+        for hWnd in reversed(list(self._candidates(window_class, window_title))):
+            if self.windows[hWnd][2] <= since:
+                # the class index is in the order windows were shown,
+                # a renamed window moves to the end of the title index
+                if window_title is None and window_class is not None:
+                    break
+                continue
+            if self.matches(hWnd, window_class, window_title):
+                return hWnd
+        return None
+
+    def wait_for_new(self, since, window_class=None, window_title=None, timeout=5.0):
+        """ return the newest window shown after `since` with this class and title, or None on timeout """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                hWnd = self._newest_since(since, window_class, window_title)
+                remaining = deadline - time.time()
+                if hWnd is not None or remaining <= 0:
+                    return hWnd
+                self.condition.wait(remaining)
+
+    def focus(self, hWnd):
+        self.backend.focus(hWnd)
+
+
+class SingletonStore:
+    """ {singleton id: {'hWnd', 'title'}}, least recently used first """
+
+    def __init__(self, registry, path=None, capacity=64, flush_delay=5.0):
+        self.registry = registry
+        self.path = path
+        self.capacity = capacity
+        self.flush_delay = flush_delay
+        self.windows = collections.OrderedDict()
+        self.dirty = False
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                saved = json.load(fp)
+        except (OSError, ValueError, TypeError):
+            return
+        with self.lock:
+            for key, window in saved:
+                # handles of windows closed since are dropped
+                if self.registry.matches(window['hWnd']):
+                    self.windows[key] = window
+
+    def get(self, key, window_class=None, window_title=None):
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None:
+                return None
+            if not self.registry.matches(window['hWnd'], window_class, window_title):
+                del self.windows[key]
+                self.dirty = True
+                return None
+            self.windows.move_to_end(key)
+            return window
+
+    def set(self, key, window):
+        with self.lock:
+            if self.windows.get(key) == window:
+                self.windows.move_to_end(key)
+                return
+            self.windows[key] = window
+            self.windows.move_to_end(key)
+            while len(self.windows) > self.capacity:
+                self.windows.popitem(last=False)
+            self.dirty = True
+            if self.timer is None and self.path is not None:
+                self.timer = threading.Timer(self.flush_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty or self.path is None:
+                return
+            saved = [[key, window] for key, window in self.windows.items()
+                     if self.registry.matches(window['hWnd'])]
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        writing = self.path + '.writing'
+        with open(writing, 'w') as fp:
+            json.dump(saved, fp)
+        os.replace(writing, self.path)
+
+
+class FakeBackend:
+    def __init__(self):
+        self.registry = None
+        # {hWnd: (class, title)}
+        self.windows = {}
+        self.focused = None
+        self.next_hWnd = 1
+
+    def start(self, registry):
+        self.registry = registry
+
+    def stop(self):
+        self.registry = None
+
+    def enumerate(self):
+        return [(hWnd, window[0], window[1]) for hWnd, window in self.windows.items()]
+
+    def create(self, window_class, title):
+        hWnd = self.next_hWnd
+        self.next_hWnd += 1
+        self.windows[hWnd] = (window_class, title)
+        if self.registry:
+            self.registry.on_show(hWnd, window_class, title)
+        return hWnd
+
+    def close(self, hWnd):
+        del self.windows[hWnd]
+        if self.registry:
+            self.registry.on_hide(hWnd)
+
+    def rename(self, hWnd, title):
+        self.windows[hWnd] = (self.windows[hWnd][0], title)
+        if self.registry:
+            self.registry.on_rename(hWnd, title)
+
+    def focus(self, hWnd):
+        self.focused = hWnd
+
+
+if platform.system() == 'Windows':
+    import ctypes
+    from ctypes import wintypes
+
+    user32 = ctypes.windll.user32
+    kernel32 = ctypes.windll.kernel32
+
+    EnumWindowsProc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+    WinEventProc = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+                                      wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+    user32.SetWinEventHook.restype = wintypes.HANDLE
+    user32.SetWinEventHook.argtypes = [wintypes.UINT, wintypes.UINT, wintypes.HANDLE, WinEventProc,
+                                       wintypes.DWORD, wintypes.DWORD, wintypes.UINT]
+    user32.GetAncestor.restype = wintypes.HWND
+    user32.GetForegroundWindow.restype = wintypes.HWND
+
+    EVENT_OBJECT_DESTROY = 0x8001
+    EVENT_OBJECT_SHOW = 0x8002
+    EVENT_OBJECT_HIDE = 0x8003
+    EVENT_OBJECT_NAMECHANGE = 0x800C
+    OBJID_WINDOW = 0
+    GA_ROOT = 2
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+    WM_QUIT = 0x0012
+    SW_MINIMIZE = 6
+    SW_RESTORE = 9
+
+    def get_window_class(hWnd):
+        buff = ctypes.create_unicode_buffer(256)
+        user32.GetClassNameW(hWnd, buff, 255)
+        return buff.value
+
+    def get_window_title(hWnd):
+        length = user32.GetWindowTextLengthW(hWnd)
+        buff = ctypes.create_unicode_buffer(length + 1)
+        user32.GetWindowTextW(hWnd, buff, length + 1)
+        return buff.value
+
+    def is_top_level(hWnd):
+        return user32.IsWindowVisible(hWnd) and user32.GetAncestor(hWnd, GA_ROOT) == hWnd
+
+    class Win32Backend:
+        def __init__(self):
+            self.registry = None
+            self.thread = None
+            self.thread_id = None
+            self.ready = threading.Event()
+            # keep the callback alive as long as the hooks
+            self.callback = WinEventProc(self.on_event)
+
+        def start(self, registry):
+            self.registry = registry
+            self.thread = threading.Thread(target=self.run, name='open_url window events')
+            self.thread.daemon = True
+            self.thread.start()
+            self.ready.wait(5)
+
+        def stop(self):
+            if self.thread_id is not None:
+                user32.PostThreadMessageW(self.thread_id, WM_QUIT, 0, 0)
+
+        def run(self):
+            # win event hooks are called on the thread which installed them, while it pumps messages
+            self.thread_id = kernel32.GetCurrentThreadId()
+            flags = WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+            hooks = [user32.SetWinEventHook(EVENT_OBJECT_DESTROY, EVENT_OBJECT_HIDE, 0, self.callback, 0, 0, flags),
+                     user32.SetWinEventHook(EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_NAMECHANGE, 0, self.callback, 0, 0, flags)]
+            self.ready.set()
+            msg = wintypes.MSG()
+            while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+            for hook in hooks:
+                if hook:
+                    user32.UnhookWinEvent(hook)
+            self.thread_id = None
+
+        def on_event(self, hook, event, hWnd, id_object, id_child, thread, time):
+            if id_object != OBJID_WINDOW or id_child != 0 or not hWnd:
+                return
+            if event in (EVENT_OBJECT_HIDE, EVENT_OBJECT_DESTROY):
+                self.registry.on_hide(hWnd)
+            elif event == EVENT_OBJECT_SHOW:
+                if is_top_level(hWnd):
+                    self.registry.on_show(hWnd, get_window_class(hWnd), get_window_title(hWnd))
+            elif event == EVENT_OBJECT_NAMECHANGE:
+                self.registry.on_rename(hWnd, get_window_title(hWnd))
+
+        def enumerate(self):
+            windows = []
+
+            def callback(hWnd, lParam):
+                if user32.IsWindowVisible(hWnd):
+                    windows.append((hWnd, get_window_class(hWnd), get_window_title(hWnd)))
+                return True
+            user32.EnumWindows(EnumWindowsProc(callback), 0)
+            return windows
+
+        # reference: https://gist.github.com/EBNull/1419093
+        def focus(self, hWnd):
+            if user32.GetForegroundWindow() == hWnd:
+                return
+            user32.ShowWindow(hWnd, SW_MINIMIZE)
+            user32.ShowWindow(hWnd, SW_RESTORE)
+else:
+    Win32Backend = None
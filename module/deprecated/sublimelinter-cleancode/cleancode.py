@@ -1,13 +1,18 @@
 # noqa: cov, E501, D
 import os
 import sys
+import time
+import queue
 import unittest
 import warnings
 import traceback
 import doctest
+import linecache
 
 import re
 
+from noqa import PrefixMatcher, scanDirectives
+
 debug = print
 
 
@@ -34,6 +39,8 @@ def loadTarget(target):
     if cwd != sys.path[0]:
         need_cleanup = True
         sys.path.insert(0, cwd)
+    # doctest line numbers come from linecache, which may hold an older version of the target
+    linecache.checkcache(target)
     dotted_path = os.path.basename(target).replace('.py', '').replace(os.sep, '.')
     debug("dotted_path is '{}'".format(dotted_path))
 
@@ -54,6 +61,17 @@ def loadTarget(target):
     return tests, doctests
 
 
+def loadTestModule(test_module, target):
+    """Return the tests of `test_module`, which may import the target from its own folder."""
+    target_parent = os.path.dirname(os.path.abspath(target))
+    sys.path.insert(0, target_parent)
+    try:
+        tests, doctests = loadTarget(test_module)
+    finally:
+        sys.path.remove(target_parent)
+    return tests
+
+
 class TestResult(unittest.TestResult):
     def __init__(self):
         super().__init__()
@@ -144,7 +162,11 @@ def runFlake8(target):
     return errors
 
 
-def runUnitTest(target, run_doctest=True):
+def runUnitTest(target, run_doctest=True, test_modules=(), stats=None):
+    """
+    Run the tests of the target, and of `test_modules`, like test_target.py.
+    `stats` is filled with the number of statements and of missing lines.
+    """
     from coverage import coverage as Coverage
     warns_list = []
     testerrors = []
@@ -165,65 +187,81 @@ def runUnitTest(target, run_doctest=True):
             test.run(result)
             if doctests and run_doctest:
                 doctests.run(result)
+            for test_module in test_modules:
+                loadTestModule(test_module, target).run(result)
         except:
             error_type, error_value, error_traceback = sys.exc_info()
-            filename, lineno, funcname, line = matchFileInTraceback(target, error_traceback)
-            testerrors.append({'path': filename,
-                               'row': int(lineno),
-                               'col': 1,
-                               'code': 'U202',
-                               'text': repr(error_value)})
+            testerrors.append(loadError(target, error_traceback, error_value))
         finally:
             result.stopTestRun()
 
     cov.stop()
 
-    warns = []
-    for message, warn_traceback in warns_list:
-        filename, lineno, funcname, line = matchFileInTraceback(target, warn_traceback)
-        warns.append({'path': filename,
-                      'row': lineno,
-                      'col': 1,
-                      'code': 'U101',
-                      'text': message})
-
-    for test, (error_type, error_value, error_traceback) \
-            in result.unsuccess_list:
-        casefile, caselineno, casename, is_doctest = getTestCaseLine(test)
-        if error_type is not None:
-            # when result is not UnexpectedSuccess
-            if is_doctest:
-                filename, lineno, funcname, excepted, got = \
-                    doctest_regex(error_value.args[0]).groups()
-                testerrors.append({'path': filename,
-                                   'row': int(lineno),
-                                   'col': 1,
-                                   'code': 'U203',
-                                   'text': 'Excepted: {}; Got: {}'.format(excepted, got)})
-            else:
-                filename, lineno, funcname, line = matchFileInTraceback(casefile, error_traceback)
-                testerrors.append({'path': filename,
-                                   'row': lineno,
-                                   'col': 1,
-                                   'code': 'U202',
-                                   'text': repr(error_value)})
-
-        testerrors.append({'path': casefile,
-                           'row': caselineno,
+    warns = [warningError(target, message, warn_traceback) for message, warn_traceback in warns_list]
+    for test, err in result.unsuccess_list:
+        testerrors.extend(testCaseErrors(test, err))
+    filename, statements, missing_linenos, missing_text = cov.analysis(target)
+    if stats is not None:
+        stats['statements'] = len(statements)
+        stats['missing'] = len(missing_linenos)
+    missings = missingErrors(target, missing_linenos)
+    return warns, testerrors, missings
+
+
+def loadError(target, error_traceback, error_value):
+    filename, lineno, funcname, line = matchFileInTraceback(target, error_traceback)
+    return {'path': filename,
+            'row': int(lineno),
+            'col': 1,
+            'code': 'U202',
+            'text': repr(error_value)}
+
+
+def warningError(target, message, warn_traceback):
+    filename, lineno, funcname, line = matchFileInTraceback(target, warn_traceback)
+    return {'path': filename,
+            'row': lineno,
+            'col': 1,
+            'code': 'U101',
+            'text': message}
+
+
+def testCaseErrors(test, err):
+    error_type, error_value, error_traceback = err
+    errors = []
+    casefile, caselineno, casename, is_doctest = getTestCaseLine(test)
+    if error_type is not None:
+        # when result is not UnexpectedSuccess
+        if is_doctest:
+            filename, lineno, funcname, excepted, got = \
+                doctest_regex(error_value.args[0]).groups()
+            errors.append({'path': filename,
+                           'row': int(lineno),
+                           'col': 1,
+                           'code': 'U203',
+                           'text': 'Excepted: {}; Got: {}'.format(excepted, got)})
+        else:
+            filename, lineno, funcname, line = matchFileInTraceback(casefile, error_traceback)
+            errors.append({'path': filename,
+                           'row': lineno,
                            'col': 1,
-                           'code': 'U201',
-                           'text': '{} failed'.format('doctest' if is_doctest else 'unittest')})
-
-    missing_linenos = cov.analysis(target)[2]
-    missings = []
-    for lineno in missing_linenos:
-        missings.append({'path': target,
-                         'row': lineno,
-                         'col': 0,
-                         'code': 'V100',
-                         'text': 'never executed'})
+                           'code': 'U202',
+                           'text': repr(error_value)})
+
+    errors.append({'path': casefile,
+                   'row': caselineno,
+                   'col': 1,
+                   'code': 'U201',
+                   'text': '{} failed'.format('doctest' if is_doctest else 'unittest')})
+    return errors
 
-    return warns, testerrors, missings
+
+def missingErrors(target, linenos):
+    return [{'path': target,
+             'row': lineno,
+             'col': 0,
+             'code': 'V100',
+             'text': 'never executed'} for lineno in linenos]
 
 
 pep8_format = '%(path)s:%(row)d:%(col)d: %(code)s %(text)s'
@@ -234,48 +272,225 @@ doctest_regex = re.compile(r'File "(.*?)", line (\d+), in (.*?)\n'
                            ).search
 
 
-def formatAndFilterErrors(noqas, inline_noqas, errors):
-    cwd = os.getcwd()
+def formatAndFilterErrors(noqas, inline_noqas, errors, cwd=None):
+    # paths are relative to `cwd`, the current directory by default
+    cwd = cwd or os.getcwd()
+    ignored = PrefixMatcher(noqas)
     for error in errors:
         inline_noqa = inline_noqas.get(error['row'], None)
         if inline_noqa is True:
             continue
 
-        if all(not error['code'].startswith(noqa) for noqa in noqas) \
-           or (inline_noqa is not None
-               and all(not error['code'].startswith(noqa) for noqa in inline_noqa)):
+        if not ignored(error['code']) \
+           or (inline_noqa is not None and not inline_noqa(error['code'])):
             error = error.copy()
             error['path'] = os.path.relpath(error['path'], cwd)
             yield pep8_format % error
 
 
-def runIter(target, noqas=None):
-    noqa = re.compile(r'^\s*# noqa[:=]\s*([ ,a-zA-Z0-9]*)', re.I).search
-    inline_noqa = re.compile(r'^.+?# noqa[:=]\s*([ ,a-zA-Z0-9]*)', re.I).search
-    inline_noqa_all_ignored = re.compile(r'^.+?# noqa\s*$', re.I).search
+# {module name: mtime of its file when it was imported}
+_module_mtimes = {}
+
+
+def moduleFile(module):
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    if filename.endswith(('.pyc', '.pyo')):
+        filename = filename[:-1]
+    return os.path.abspath(filename)
+
+
+def refreshLocalModules(directory):
+    """Forget the imported modules of `directory` whose file changed since they were imported."""
+    directory = os.path.abspath(directory) + os.sep
+    for name, module in list(sys.modules.items()):
+        filename = moduleFile(module)
+        if filename is None or not filename.startswith(directory):
+            continue
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            mtime = None
+        if name not in _module_mtimes:
+            _module_mtimes[name] = mtime
+        elif _module_mtimes[name] != mtime:
+            del sys.modules[name]
+            del _module_mtimes[name]
+
+
+# {target: the state of its last impact.runImpactedUnitTest}
+_impact_states = {}
+
+
+def runUnitTestImpacted(target, run_doctest=True):
+    from impact import runImpactedUnitTest
+    target = os.path.abspath(target)
+    warns, testerrors, missings, state = runImpactedUnitTest(target, _impact_states.get(target), run_doctest)
+    if state is None:
+        _impact_states.pop(target, None)
+    else:
+        _impact_states[target] = state
+    return warns, testerrors, missings
+
+
+def runTestPhase(target, run_doctest, impact, state):
+    """Run the tests in a pool process, return warns, testerrors, missings and the impact state."""
+    directory = os.path.dirname(target)
+    refreshLocalModules(directory)
+    try:
+        if impact:
+            from impact import runImpactedUnitTest
+            return runImpactedUnitTest(target, state, run_doctest)
+        return runUnitTest(target, run_doctest) + (None,)
+    finally:
+        # remember when the modules imported by this run were loaded
+        refreshLocalModules(directory)
+
+
+# the style and the test phases run side by side in these processes, which
+# keep flake8, coverage and the modules of the target imported between runs
+_pool = None
+
+
+def quietProcess():
+    """Initialize a pool process: its output must not reach the stdout of the worker, see worker.main."""
+    global debug
+    sys.stdout = sys.stderr
+    debug = lambda *args, **kwargs: None  # noqa: E731
+
+
+def phasePool():
+    global _pool
+    if _pool is None:
+        import multiprocessing
+        # a spawned process does not inherit the redirection of its parent
+        _pool = multiprocessing.Pool(2, initializer=quietProcess)
+    return _pool
+
 
-    noqas = noqas or []
-    inline_noqas = {}
+def resetPhasePool():
+    # the only way to stop a hanging test
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+def timeoutError(target, phase, timeout):
+    return {'path': target,
+            'row': 1,
+            'col': 1,
+            'code': 'U102',
+            'text': '{} timed out after {}s'.format(phase, timeout)}
+
+
+def testLines(noqas, inline_noqas, warns, testerrors, missings, cwd=None):
+    if 'test' not in noqas and (warns or testerrors):
+        yield from formatAndFilterErrors(noqas, inline_noqas, warns + testerrors, cwd)
+    elif 'cov' not in noqas:
+        yield from formatAndFilterErrors(noqas, inline_noqas, missings, cwd)
+
+
+def runPhasesParallel(target, noqas, inline_noqas, run_style, run_doctest, impact, timeout, cwd):
+    """
+    `timeout` is the seconds each phase may run, for both phases, or a dict
+    like {'flake8': 10, 'unittest': 30}; a phase missing from it, or None,
+    has no limit.
+    """
+    target = os.path.abspath(target)
+    pool = phasePool()
+    finished = queue.Queue()
+    timeouts = timeout if isinstance(timeout, dict) else {'flake8': timeout, 'unittest': timeout}
+    # {phase: the time it times out at, or None}
+    deadlines = {}
+
+    def submit(phase, function, args):
+        phase_timeout = timeouts.get(phase)
+        deadlines[phase] = time.time() + phase_timeout if phase_timeout else None
+        pool.apply_async(function, args,
+                         callback=lambda result: finished.put((phase, result, None)),
+                         error_callback=lambda error: finished.put((phase, None, error)))
+
+    if run_style:
+        submit('flake8', runFlake8, (target,))
+    state = _impact_states.pop(target, None) if impact else None
+    submit('unittest', runTestPhase, (target, run_doctest, impact, state))
+
+    pending = set(deadlines)
+    timed_out = []
+    try:
+        while pending:
+            limited = [deadlines[phase] for phase in pending if deadlines[phase] is not None]
+            wait = max(0, min(limited) - time.time()) if limited else None
+            try:
+                phase, result, error = finished.get(timeout=wait)
+            except queue.Empty:
+                # the other phases still get the rest of their own time
+                now = time.time()
+                expired = sorted(phase for phase in pending if deadlines[phase] is not None and deadlines[phase] <= now)
+                pending.difference_update(expired)
+                timed_out.extend(expired)
+                yield from formatAndFilterErrors(noqas, inline_noqas,
+                                                 [timeoutError(target, phase, timeouts[phase]) for phase in expired], cwd)
+                continue
+            if phase not in pending:
+                continue
+            pending.discard(phase)
+            if error is not None:
+                raise error
+            if phase == 'flake8':
+                yield from formatAndFilterErrors(noqas, inline_noqas, result, cwd)
+            else:
+                warns, testerrors, missings, state = result
+                if state is not None:
+                    _impact_states[target] = state
+                yield from testLines(noqas, inline_noqas, warns, testerrors, missings, cwd)
+    finally:
+        # the only way to stop a phase which timed out
+        if timed_out:
+            resetPhasePool()
+
+
+def runIter(target, noqas=None, impact=False, parallel=False, timeout=None, test_modules=(), stats=None):
+    """
+    Yield the pep8-format lines of the target, with impact=True only the
+    tests affected by the change since the last run with impact are run.
+
+    With parallel=True, flake8 and the tests run side by side in a process
+    pool, the lines of each phase are yielded as soon as it finishes, and a
+    phase still running after `timeout` seconds is reported and stopped.
+
+    A serial run without impact also runs the tests of `test_modules`, and
+    fills `stats` with the coverage of the target, see runUnitTest.
+    Paths are relative to the current directory when runIter is called.
+    """
+    cwd = os.getcwd()
     with open(target, encoding='utf-8') as fp:
-        for lineno_minus_one, line in enumerate(fp):
-            lineno = lineno_minus_one + 1
-            if noqa(line):
-                noqas.extend(word.strip() for word in noqa(line).group(1).split(','))
-            elif inline_noqa(line):
-                inline_noqas[lineno] = [word.strip() for word in inline_noqa(line).group(1).split(',')]
-            elif inline_noqa_all_ignored(line):
-                inline_noqas[lineno] = True
-
-    if 'pep8' not in noqas and 'flake8' not in noqas:
+        file_noqas, inline_noqas = scanDirectives(fp.read())
+    noqas = (noqas or []) + file_noqas
+
+    run_style = 'pep8' not in noqas and 'flake8' not in noqas
+    run_doctest = 'doctest' not in noqas
+    if parallel:
+        yield from runPhasesParallel(target, noqas, inline_noqas, run_style, run_doctest, impact, timeout, cwd)
+        return
+
+    if run_style:
         errors = runFlake8(target)
         if errors:
-            yield from formatAndFilterErrors(noqas, inline_noqas, errors)
+            yield from formatAndFilterErrors(noqas, inline_noqas, errors, cwd)
 
-    warns, testerrors, missings = runUnitTest(target, run_doctest='doctest' not in noqas)
-    if 'test' not in noqas and (warns or testerrors):
-        yield from formatAndFilterErrors(noqas, inline_noqas, warns + testerrors)
-    elif 'cov' not in noqas:
-        yield from formatAndFilterErrors(noqas, inline_noqas, missings)
+    if 'test' in noqas and 'cov' in noqas:
+        # nothing of the tests would be reported
+        return
+    if impact:
+        warns, testerrors, missings = runUnitTestImpacted(target, run_doctest=run_doctest)
+    else:
+        warns, testerrors, missings = runUnitTest(target, run_doctest=run_doctest,
+                                                  test_modules=test_modules, stats=stats)
+    yield from testLines(noqas, inline_noqas, warns, testerrors, missings, cwd)
 
 
 def runAndPrint(target, noqas=None):
@@ -283,5 +498,131 @@ def runAndPrint(target, noqas=None):
         print(line)
 
 
+def isTestModule(filename):
+    name = os.path.basename(filename)
+    return name.startswith('test_') or name.endswith('_test.py')
+
+
+def discoverTargets(directory):
+    """Return the python files of `directory`, hidden folders and __pycache__ excepted."""
+    targets = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.') and name != '__pycache__')
+        targets.extend(os.path.join(root, name) for name in sorted(files) if name.endswith('.py'))
+    return targets
+
+
+def testModulesOf(target, targets):
+    """Return the test modules of the target among `targets`: test_x.py, x_test.py and tests/test_x.py."""
+    if isTestModule(target):
+        return []
+    parent, name = os.path.split(target)
+    stem = name[:-len('.py')]
+    names = [os.path.join(parent, 'test_' + name),
+             os.path.join(parent, stem + '_test.py'),
+             os.path.join(parent, 'tests', 'test_' + name)]
+    return [filename for filename in names if filename in targets]
+
+
+def lintProjectFile(job):
+    """Return the target, its pep8-format lines and its coverage stats, run in a runProject process."""
+    target, test_modules, noqas, cwd, root = job
+    root = os.path.join(root, '')
+    os.chdir(cwd)
+    stats = {'statements': 0, 'missing': 0}
+    try:
+        lines = list(runIter(target, noqas, test_modules=test_modules, stats=stats))
+    finally:
+        # two files of the project may have the same module name; pep8, flake8 and
+        # coverage stay imported for the next job, coverage cannot be imported twice
+        for name, module in list(sys.modules.items()):
+            filename = moduleFile(module)
+            if filename and filename.startswith(root) and 'site-packages' not in filename:
+                del sys.modules[name]
+    return target, lines, stats
+
+
+def lineKey(line):
+    path, row, col = line.split(':', 3)[:3]
+    return (path, int(row) if row.isdigit() else 0, int(col) if col.isdigit() else 0)
+
+
+def runProject(directory, processes=None, out=sys.stdout):
+    """
+    Lint every python file of `directory` in a process pool, with the tests
+    of its test modules, print the lines sorted per file, then the number of
+    files per second and the coverage of the whole project on stderr.
+    """
+    import multiprocessing
+    cwd = os.getcwd()
+    start = time.time()
+    root = os.path.abspath(directory)
+    targets = [os.path.abspath(target) for target in discoverTargets(directory)]
+    known = set(targets)
+    test_modules = dict((target, testModulesOf(target, known)) for target in targets)
+    # a test module runs with the target it tests, and is only checked for style on its own
+    tested = set(module for modules in test_modules.values() for module in modules)
+    jobs = [(target, test_modules[target], ['test', 'cov'] if target in tested else [], cwd, root)
+            for target in targets]
+    results = []
+    # the tests may print, only the lines of runProject go to stdout
+    with multiprocessing.Pool(processes, initializer=quietProcess) as pool:
+        for result in pool.imap_unordered(lintProjectFile, jobs):
+            results.append(result)
+
+    statements = missing = 0
+    for target, lines, stats in sorted(results):
+        for line in sorted(lines, key=lineKey):
+            print(line, file=out)
+        statements += stats['statements']
+        missing += stats['missing']
+    elapsed = time.time() - start
+    print('{} files in {:.2f} s, {:.1f} files/sec'.format(len(results), elapsed, len(results) / max(elapsed, 1e-6)),
+          file=sys.stderr)
+    if statements:
+        print('coverage {:.1f}% of {} statements'.format(100.0 * (statements - missing) / statements, statements),
+              file=sys.stderr)
+
+
+def checkProject(processes=2):
+    """Lint a project of more files than processes, so a process lints several files, and check every file is reported."""
+    import io
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix='cleancode')
+    try:
+        names = ['module{}.py'.format(index) for index in range(processes * 2 + 1)]
+        for name in names:
+            with open(os.path.join(directory, name), 'w') as fp:
+                fp.write('"""A module."""\nimport helper\nvalue=helper.value\n')
+            with open(os.path.join(directory, 'test_' + name), 'w') as fp:
+                fp.write('"""Its tests."""\nimport unittest\nimport {}\n\n\n'
+                         'class Test(unittest.TestCase):\n\n'
+                         '    def test_value(self):\n'
+                         '        self.assertEqual({}.value, 1)\n'.format(name[:-3], name[:-3]))
+        with open(os.path.join(directory, 'helper.py'), 'w') as fp:
+            fp.write('"""A helper."""\nvalue = 1\n')
+        out = io.StringIO()
+        runProject(directory, processes, out)
+        reported = set(os.path.basename(line.split(':')[0]) for line in out.getvalue().splitlines())
+        assert set(names) <= reported, out.getvalue()
+    finally:
+        shutil.rmtree(directory)
+
+
 if __name__ == '__main__':
-    runAndPrint(sys.argv[1])
+    import argparse
+    parser = argparse.ArgumentParser(description='lint a python file, or every python file of a project')
+    parser.add_argument('target', nargs='?', help='the python file to lint')
+    parser.add_argument('--project', metavar='DIR', help='lint the python files of DIR with their test modules')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='processes of --project, one per cpu by default')
+    parser.add_argument('--check', action='store_true', help='lint a generated project of more files than processes')
+    args = parser.parse_args()
+    if args.check:
+        checkProject(args.jobs or 2)
+    elif args.project:
+        runProject(args.project, args.jobs)
+    elif args.target:
+        runAndPrint(args.target)
+    else:
+        parser.error('a target or --project is required')
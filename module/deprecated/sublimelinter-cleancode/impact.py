@@ -0,0 +1,259 @@
+# noqa: cov, E501, D
+"""
+Run only the tests of a target which are affected by its last change.
+
+A run records the lines of the target covered by each test. The next run
+diffs the target against the recorded source: tests covering a function
+whose body changed run again, the results of the other tests are kept and
+moved to their new line numbers. A change outside of function bodies, like
+an import, a class attribute or a new test, or in a function run outside of
+the tests, like a fixture, runs every test again, and so does a change of a
+module next to the target.
+
+usage:
+    warns, testerrors, missings, state = runImpactedUnitTest(target, state)
+"""
+import os
+import ast
+import sys
+import difflib
+import unittest
+import warnings
+import traceback
+
+import cleancode
+
+
+def functionBodies(source):
+    """Return the (first, last) lines of the body of every function, None on a syntax error."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    bodies = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, getattr(ast, 'AsyncFunctionDef', ast.FunctionDef))):
+            last = max(getattr(child, 'lineno', 0) for child in ast.walk(node))
+            bodies.append((node.body[0].lineno, last))
+    return bodies
+
+
+def enclosingBody(bodies, first, last):
+    """Return the innermost body containing the lines first to last, or None."""
+    enclosing = [body for body in bodies if body[0] <= first and last <= body[1]]
+    return min(enclosing, key=lambda body: body[1] - body[0]) if enclosing else None
+
+
+def changedBodies(old_lines, new_lines):
+    """
+    Return the old function bodies touched by the change and a map of the
+    unchanged lines {old lineno: new lineno}, or None for a change outside
+    of function bodies.
+    """
+    old_bodies = functionBodies(''.join(old_lines))
+    new_bodies = functionBodies(''.join(new_lines))
+    if old_bodies is None or new_bodies is None:
+        return None
+    bodies = set()
+    linemap = {}
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                linemap[i1 + offset + 1] = j1 + offset + 1
+            continue
+        # an insertion, or a deletion on the new side, sits between two lines
+        old_body = enclosingBody(old_bodies, *((i1 + 1, i2) if i2 > i1 else (i1, i1 + 1)))
+        new_body = enclosingBody(new_bodies, *((j1 + 1, j2) if j2 > j1 else (j1, j1 + 1)))
+        if old_body is None or new_body is None:
+            return None
+        bodies.add(old_body)
+    return bodies, linemap
+
+
+def localModuleMtimes(target):
+    directory = os.path.dirname(target) + os.sep
+    mtimes = {}
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if not filename or not os.path.abspath(filename).startswith(directory):
+            continue
+        filename = os.path.abspath(filename)
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+        if filename == target:
+            continue
+        try:
+            mtimes[filename] = os.stat(filename).st_mtime
+        except OSError:
+            # not from a file, like the __main__ of `python -`
+            pass
+    return mtimes
+
+
+def modulesChanged(mtimes):
+    for filename, mtime in mtimes.items():
+        try:
+            if os.stat(filename).st_mtime != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def remapErrors(errors, target, linemap):
+    remapped = []
+    for error in errors:
+        if os.path.abspath(error['path']) == target:
+            if error['row'] not in linemap:
+                continue
+            error = dict(error, row=linemap[error['row']])
+        remapped.append(error)
+    return remapped
+
+
+def iterTests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iterTests(test)
+        else:
+            yield test
+
+
+class ImpactResult(cleancode.TestResult):
+    """Measure the coverage of each test on its own."""
+
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
+        # {test id: {'lines', 'errors', 'warns'}}
+        self.records = {}
+        self.current = None
+        self.coverage = None
+
+    def startTest(self, test):
+        from coverage import Coverage
+        super().startTest(test)
+        self.current = self.records.setdefault(test.id(), {'lines': [], 'errors': [], 'warns': []})
+        # stacked on the coverage of the whole run, which pauses meanwhile
+        self.coverage = Coverage(config_file=False)
+        self.coverage.start()
+
+    def stopTest(self, test):
+        self.coverage.stop()
+        self.current['lines'] = sorted(self.coverage.get_data().lines(self.target) or [])
+        self.current = None
+        super().stopTest(test)
+
+    def record(self, test, err):
+        self.records[test.id()]['errors'].extend(cleancode.testCaseErrors(test, err))
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self.record(test, err)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self.record(test, err)
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self.record(test, err)
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self.record(test, (None, None, None))
+
+
+def runImpactedUnitTest(target, state=None, run_doctest=True):
+    """
+    Like cleancode.runUnitTest, with the state returned by the previous run
+    of the same target. Return warns, testerrors, missings and the new state.
+    """
+    from coverage import Coverage
+    target = os.path.abspath(target)
+    with open(target, encoding='utf-8') as fp:
+        source = fp.readlines()
+
+    # {test id: {'lines', 'errors', 'warns'}} of the tests which are not run again
+    records = {}
+    fixture_lines = set()
+    fixture_warns = []
+    selected = None
+    if state is not None and state['run_doctest'] == run_doctest and not modulesChanged(state['modules']):
+        changed = changedBodies(state['source'], source)
+        if changed is not None and not any(first <= line <= last for line in state['fixture_lines']
+                                           for first, last in changed[0]):
+            # a changed function run outside of the tests, like setUpClass, needs a full run too
+            bodies, linemap = changed
+            selected = set()
+            for test_id, record in state['tests'].items():
+                if any(first <= line <= last for line in record['lines'] for first, last in bodies):
+                    selected.add(test_id)
+                    continue
+                records[test_id] = {'lines': [linemap[line] for line in record['lines'] if line in linemap],
+                                    'errors': remapErrors(record['errors'], target, linemap),
+                                    'warns': remapErrors(record['warns'], target, linemap)}
+            fixture_lines = set(linemap[line] for line in state['fixture_lines'] if line in linemap)
+            fixture_warns = remapErrors(state['fixture_warns'], target, linemap)
+
+    cov = Coverage()
+    if selected is not None and not selected:
+        # no test covers the change, the target is not even imported
+        statements = cov.analysis(target)[1]
+    else:
+        result = ImpactResult(target)
+        loaderrors = []
+        fixture_warns = []
+        cov.start()
+        with warnings.catch_warnings():
+            # suppress dafault stdout warning from python builtin, keep it with its test
+            def warn_record_traceback(message, category, filename, lineno,
+                                      file=None, line=None):
+                warns = result.current['warns'] if result.current is not None else fixture_warns
+                warns.append(cleancode.warningError(target, message, traceback.extract_stack()))
+
+            warnings.showwarning = warn_record_traceback
+            result.startTestRun()
+            try:
+                tests, doctests = cleancode.loadTarget(target)
+                suite = list(iterTests(tests))
+                if doctests and run_doctest:
+                    suite.extend(iterTests(doctests))
+                if selected is not None:
+                    # and the tests added since, like a new doctest in a docstring
+                    suite = [test for test in suite if test.id() in selected or test.id() not in state['tests']]
+                unittest.TestSuite(suite).run(result)
+            except:
+                error_type, error_value, error_traceback = sys.exc_info()
+                loaderrors.append(cleancode.loadError(target, error_traceback, error_value))
+            finally:
+                result.stopTestRun()
+        cov.stop()
+
+        if loaderrors:
+            # nothing worth keeping for the next run
+            return fixture_warns, loaderrors, [], None
+        records.update(result.records)
+        fixture_lines.update(cov.get_data().lines(target) or [])
+        statements = cov.analysis(target)[1]
+
+    executed = set(fixture_lines)
+    warns = list(fixture_warns)
+    testerrors = []
+    for test_id in sorted(records):
+        executed.update(records[test_id]['lines'])
+        warns.extend(records[test_id]['warns'])
+        testerrors.extend(records[test_id]['errors'])
+    missings = cleancode.missingErrors(target, sorted(set(statements) - executed))
+
+    new_state = {
+        'source': source,
+        'tests': records,
+        'fixture_lines': sorted(fixture_lines),
+        'fixture_warns': fixture_warns,
+        'modules': localModuleMtimes(target),
+        'run_doctest': run_doctest,
+    }
+    return warns, testerrors, missings, new_state
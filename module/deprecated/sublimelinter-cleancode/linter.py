@@ -8,8 +8,14 @@ from SublimeLinter.lint import PythonLinter
 _thisdir = os.path.dirname(__file__)
 if _thisdir not in sys.path[0]:
     sys.path.insert(0, _thisdir)
+import noqa
+imp.reload(noqa)
 import cleancode
 imp.reload(cleancode)
+import worker
+imp.reload(worker)
+import resultcache
+imp.reload(resultcache)
 
 
 class Clean8(PythonLinter):
@@ -56,4 +62,9 @@ class Clean8(PythonLinter):
     module = 'cleancode'
 
     def check(self, code, filename):
-        return list(cleancode.runIter(filename))
+        # lint in the long-lived worker, or in sublime if there is no python to run it
+        try:
+            return worker.client().lint(filename)
+        except worker.WorkerError as error:
+            print('cleancode: {}'.format(error))
+            return resultcache.runCached(filename)
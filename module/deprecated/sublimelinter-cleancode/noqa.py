@@ -0,0 +1,86 @@
+# noqa: cov, E501, D
+"""
+Collect the noqa directives of a file in one pass, see cleancode.runIter.
+
+A noqa comment alone on its line ignores its codes in the whole file, one
+after some code ignores its codes on its line, or every code without a
+colon. The comments are found by one pattern which skips over the
+strings, so a string holding a noqa comment is not one, and the file is
+read once whatever its number of directives.
+
+usage:
+    noqas, inline_noqas = scanDirectives(text)
+    ignored = PrefixMatcher(noqas)
+    ignored('E501')
+"""
+import re
+
+# a string, skipped so a noqa comment inside it is not one, or a comment
+_lexer = re.compile(r'''
+    """(?:\\.|[^\\])*?"""
+  | \'\'\'(?:\\.|[^\\])*?\'\'\'
+  | "(?:\\.|[^\\"\n])*"
+  | '(?:\\.|[^\\'\n])*'
+  | (?P<comment>\#[^\r\n]*)
+''', re.X | re.S)
+_any_directive = re.compile(r'# noqa', re.I)
+# the codes after a colon, or nothing left on the line
+directive = re.compile(r'# noqa(?:[:=]\s*(?P<codes>[ ,a-zA-Z0-9]*)|\s*$)', re.I)
+
+
+class PrefixMatcher:
+    """Tell whether a code starts with one of the prefixes, a set lookup per distinct prefix length."""
+
+    def __init__(self, prefixes):
+        self.prefixes = frozenset(prefixes)
+        self.lengths = sorted(set(len(prefix) for prefix in self.prefixes))
+
+    def __call__(self, code):
+        for length in self.lengths:
+            if code[:length] in self.prefixes:
+                return True
+        return False
+
+
+def splitCodes(codes):
+    return [word.strip() for word in codes.split(',')]
+
+
+def addDirective(noqas, inline_noqas, lineno, before, codes):
+    if codes is not None and not before.strip():
+        noqas.extend(splitCodes(codes))
+    elif codes is not None:
+        inline_noqas[lineno] = PrefixMatcher(splitCodes(codes))
+    elif before:
+        inline_noqas[lineno] = True
+
+
+def scanDirectives(text):
+    """
+    Return the codes ignored in the whole file, and {lineno: PrefixMatcher,
+    or True to ignore every code} for the lines with their own directive.
+    """
+    noqas = []
+    inline_noqas = {}
+    last = None
+    for last in _any_directive.finditer(text):
+        pass
+    if last is None:
+        return noqas, inline_noqas
+    lineno = 1
+    counted = 0
+    for token in _lexer.finditer(text):
+        if token.start() >= last.end():
+            break
+        comment = token.group('comment')
+        if comment is None:
+            continue
+        match = directive.search(comment)
+        if match is None:
+            continue
+        position = token.start()
+        lineno += text.count('\n', counted, position)
+        counted = position
+        before = text[text.rfind('\n', 0, position) + 1:position] + comment[:match.start()]
+        addDirective(noqas, inline_noqas, lineno, before, match.group('codes'))
+    return noqas, inline_noqas
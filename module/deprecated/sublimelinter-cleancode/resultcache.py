@@ -0,0 +1,187 @@
+# noqa: cov, E501, D
+"""
+Keep the lines of cleancode.runIter on disk, so saving a file without a
+change, or going back to a buffer linted before, does not run flake8, the
+tests and coverage again.
+
+A result is keyed by the path and the sha1 of the target, of the local
+modules it imports, directly or not, of the noqas and of the tool
+versions. The paths are reported relative to the folder of the target,
+like in the worker, whatever the current folder. The least recently used
+results are removed once the cache is larger than max_bytes. A result
+with a timed out phase is not kept.
+
+usage:
+    lines = runCached(target, noqas, impact=True, parallel=True, timeout=20)
+"""
+import os
+import ast
+import sys
+import json
+import hashlib
+
+import cleancode
+
+# bump when runIter reports something else for the same input
+version = 2
+
+max_bytes = 16 * 1024 * 1024
+
+# CLEANCODE_CACHE moves the cache, an empty one turns it off
+directory = os.environ.get('CLEANCODE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'cleancode'))
+
+_tool_versions = None
+
+
+def toolVersions():
+    global _tool_versions
+    if _tool_versions is None:
+        versions = [sys.version, str(version)]
+        for name in ('pep8', 'flake8', 'pyflakes', 'mccabe', 'coverage'):
+            try:
+                module = __import__(name)
+            except ImportError:
+                versions.append(name + ' none')
+            else:
+                versions.append('{} {}'.format(name, getattr(module, '__version__', '?')))
+        _tool_versions = versions
+    return _tool_versions
+
+
+def importedNames(source):
+    """Return the top level names of the modules imported by `source`, None on a syntax error."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                # from . import x, from .x import y
+                names.update([node.module.split('.')[0]] if node.module else [alias.name for alias in node.names])
+            elif node.module:
+                names.add(node.module.split('.')[0])
+    return names
+
+
+def localModuleFile(folder, name):
+    for filename in (os.path.join(folder, name + '.py'), os.path.join(folder, name, '__init__.py')):
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def dependencyDigests(target, source, test_modules=()):
+    """Return [(path, sha1)] of the local modules the target and its test modules import, followed in turn."""
+    folder = os.path.dirname(target)
+    pending = [(target, source)]
+    for test_module in test_modules:
+        pending.append((os.path.abspath(test_module), None))
+    seen = set([target])
+    digests = []
+    while pending:
+        filename, content = pending.pop()
+        if content is None:
+            with open(filename, 'rb') as fp:
+                content = fp.read()
+            digests.append((filename, hashlib.sha1(content).hexdigest()))
+        for name in sorted(importedNames(content) or ()):
+            for search in (os.path.dirname(filename), folder):
+                dependency = localModuleFile(search, name)
+                if dependency is not None:
+                    dependency = os.path.abspath(dependency)
+                    if dependency not in seen:
+                        seen.add(dependency)
+                        pending.append((dependency, None))
+                    break
+    return sorted(digests)
+
+
+def cacheKey(target, noqas=None, test_modules=()):
+    target = os.path.abspath(target)
+    with open(target, 'rb') as fp:
+        source = fp.read()
+    digest = hashlib.sha1()
+    parts = [target, hashlib.sha1(source).hexdigest(), sorted(noqas or [])]
+    parts.extend(toolVersions())
+    parts.extend(dependencyDigests(target, source, test_modules))
+    digest.update(json.dumps(parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load(key):
+    if not directory:
+        return None
+    path = os.path.join(directory, key + '.json')
+    try:
+        with open(path, encoding='utf-8') as fp:
+            lines = json.load(fp)
+        # the mtime is the last use, see evict()
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return lines
+
+
+def store(key, lines):
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, key + '.json')
+        writing = '{}.{}.writing'.format(path, os.getpid())
+        with open(writing, 'w', encoding='utf-8') as fp:
+            json.dump(lines, fp)
+        os.replace(writing, path)
+        evict()
+    except OSError:
+        pass
+
+
+def evict(limit=None):
+    """Remove the least recently used results until the cache holds `limit` bytes."""
+    limit = max_bytes if limit is None else limit
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    entries.sort()
+    while total > limit and entries:
+        mtime, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def runCached(target, noqas=None, **kwargs):
+    """Return the lines of cleancode.runIter(target, noqas, **kwargs), from the cache if nothing changed."""
+    try:
+        key = cacheKey(target, noqas, kwargs.get('test_modules', ()))
+    except OSError:
+        key = None
+    lines = load(key) if key else None
+    if lines is not None:
+        return lines
+    # cleancode.loadTarget leaves the current folder in the one of the target
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(target)))
+    try:
+        lines = list(cleancode.runIter(target, list(noqas or []), **kwargs))
+    finally:
+        os.chdir(cwd)
+    if key and not any(' U102 ' in line for line in lines):
+        store(key, lines)
+    return lines
@@ -0,0 +1,206 @@
+# noqa: cov, E501, D
+"""
+A long-lived cleancode process, so a save does not pay for a new
+interpreter and for importing flake8 and coverage again.
+
+The worker reads one json request per line on stdin and writes one json
+response per line on stdout:
+    {"id": 1, "target": "/path/to/file.py", "noqas": [], "impact": true, "timeout": 20, "cache": true}
+    {"id": 1, "lines": ["file.py:1:1: F401 ..."], "error": null, "elapsed": 0.12}
+
+flake8 and the tests run side by side in the cleancode process pool, a
+phase running longer than "timeout" seconds is reported and stopped;
+"timeout" may also give each phase its own, {"flake8": 10, "unittest": 30}.
+Modules local to the target stay imported between requests, and are
+imported again once their file changes. With "impact", only the tests
+affected by the change since the last request for the same target run
+again, see impact.py. Unless "cache" is false, a target linted before
+with the same content and local imports answers from resultcache.py.
+
+usage:
+    python worker.py                             serve requests on stdin
+    python worker.py --bench file.py [repeat]    compare a new process per save with the worker
+"""
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import threading
+import subprocess
+
+_thisdir = os.path.dirname(os.path.abspath(__file__))
+
+
+class WorkerError(Exception):
+    pass
+
+
+def serve(requests, responses):
+    import cleancode
+    import resultcache
+    # import them once, before the first request
+    import pep8  # noqa: F401
+    import flake8.main  # noqa: F401
+    import coverage  # noqa: F401
+
+    for request in requests:
+        if not request.strip():
+            continue
+        start = time.time()
+        response = {'id': None, 'lines': [], 'error': None}
+        try:
+            request = json.loads(request)
+            response['id'] = request.get('id')
+            target = os.path.abspath(request['target'])
+            # paths are reported relative to the folder of the target, like `python cleancode.py file.py`
+            os.chdir(os.path.dirname(target))
+            run = resultcache.runCached if request.get('cache', True) else cleancode.runIter
+            response['lines'] = list(run(target, list(request.get('noqas') or []),
+                                         impact=request.get('impact', False),
+                                         parallel=True, timeout=request.get('timeout')))
+        except Exception as error:
+            response['error'] = '{}: {}'.format(type(error).__name__, error)
+        response['elapsed'] = time.time() - start
+        responses.write(json.dumps(response) + '\n')
+        responses.flush()
+
+
+def main():
+    # the tests of the target may print, only responses go to the real stdout
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+    if _thisdir not in sys.path:
+        sys.path.insert(0, _thisdir)
+    serve(sys.stdin, responses)
+
+
+# the interpreters whose worker exited before its first answer, like one
+# without flake8 or coverage, are not started again in this session
+_failed_pythons = set()
+
+
+def pythonExecutable():
+    # inside sublime, sys.executable is the plugin host
+    return shutil.which('python3') or shutil.which('python') or sys.executable
+
+
+class WorkerClient:
+    def __init__(self, python=None, timeout=60, phase_timeout=20, cache=True):
+        self.python = python or pythonExecutable()
+        self.timeout = timeout
+        self.phase_timeout = phase_timeout
+        self.cache = cache
+        self.proc = None
+        self.responses = None
+        self.next_id = 0
+        self.answered = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.proc = subprocess.Popen([self.python, '-u', os.path.join(_thisdir, 'worker.py')],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, cwd=_thisdir,
+                                     universal_newlines=True)
+        self.answered = False
+        # read in a thread, so a hanging test can time out
+        self.responses = queue.Queue()
+        threading.Thread(target=self.read, args=(self.proc, self.responses), daemon=True).start()
+
+    def read(self, proc, responses):
+        for line in proc.stdout:
+            responses.put(line)
+        responses.put(None)
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def request(self, target, noqas=None, impact=True):
+        self.next_id += 1
+        request = {'id': self.next_id, 'target': os.path.abspath(target), 'noqas': noqas or [], 'impact': impact,
+                   'timeout': self.phase_timeout, 'cache': self.cache}
+        if self.proc is None or self.proc.poll() is not None:
+            if self.python in _failed_pythons:
+                raise WorkerError('{} cannot run the cleancode worker'.format(self.python))
+            self.start()
+        try:
+            self.proc.stdin.write(json.dumps(request) + '\n')
+            self.proc.stdin.flush()
+            while True:
+                line = self.responses.get(timeout=self.timeout)
+                if line is None:
+                    raise WorkerError('cleancode worker exited')
+                response = json.loads(line)
+                # skip the answer to a request which timed out before
+                if response['id'] == request['id']:
+                    self.answered = True
+                    return response
+        except (OSError, ValueError, queue.Empty, WorkerError) as error:
+            if isinstance(error, WorkerError) and not self.answered:
+                _failed_pythons.add(self.python)
+            self.stop()
+            raise WorkerError('cleancode worker failed: {!r}'.format(error))
+
+    def lint(self, target, noqas=None, impact=True):
+        """Return the pep8-format lines of cleancode.runIter(target, noqas, impact), run in the worker."""
+        with self.lock:
+            try:
+                response = self.request(target, noqas, impact)
+            except WorkerError:
+                # once more with a new worker
+                response = self.request(target, noqas, impact)
+        if response['error']:
+            raise WorkerError(response['error'])
+        return response['lines']
+
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        _client = WorkerClient()
+    return _client
+
+
+def bench(target, repeat=5):
+    target = os.path.abspath(target)
+    python = pythonExecutable()
+    cold = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([python, os.path.join(_thisdir, 'cleancode.py'), target],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(target))
+        cold.append(time.time() - start)
+
+    timings = []
+    for cache in (False, True):
+        worker = WorkerClient(python, cache=cache)
+        warm = []
+        try:
+            worker.lint(target)
+            for _ in range(repeat):
+                start = time.time()
+                worker.lint(target)
+                warm.append(time.time() - start)
+        finally:
+            worker.stop()
+        timings.append(warm)
+
+    print('{}: {} saves'.format(target, repeat), file=sys.stderr)
+    print('  new process per save  {:8.1f} ms'.format(sum(cold) / repeat * 1000), file=sys.stderr)
+    print('  warm worker           {:8.1f} ms'.format(sum(timings[0]) / repeat * 1000), file=sys.stderr)
+    print('  cached result         {:8.1f} ms'.format(sum(timings[1]) / repeat * 1000), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--bench']:
+        bench(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 5)
+    else:
+        main()